@@ -1,18 +1,310 @@
+import time
+_MODULE_STARTED = time.perf_counter()
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import sqlite3
-import pandas as pd
 import unittest
-import matplotlib.pyplot as plt
-import seaborn as sns
 import re
+import os
+import csv
+import sys
+import json
+import random
+import argparse
+import bisect
+import queue
+import shutil
+import tempfile
+import io
+import subprocess
+import threading
+import types
+import collections
+import datetime
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stderr
+
+DB_PATH = 'shop.db'
+
+# matplotlib загружается при первом открытии вкладки статистики; pyplot не нужен - графики встроены в окно
+Figure = FigureCanvasTkAgg = None
+
+def load_analytics():
+    global Figure, FigureCanvasTkAgg
+    if Figure is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+# --- Замер времени запуска ---
+class StartupTimer:
+    """Длительность фаз запуска для режима --profile-startup"""
+
+    def __init__(self, started):
+        self.last = started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self, out=None):
+        out = out or sys.stderr
+        for phase, seconds in self.phases:
+            print(f"{phase:<32}{seconds * 1000:9.1f} мс", file=out)
+        print(f"{'итого':<32}{sum(seconds for _, seconds in self.phases) * 1000:9.1f} мс", file=out)
 
 # --- Класс для работы с базой данных ---
+# --- Диагностика запросов ---
+class DatabaseError(Exception):
+    """Ошибка выполнения запроса; query - текст запроса, на котором она возникла"""
+
+    def __init__(self, message, query=None):
+        super().__init__(message)
+        self.query = query
+
+
+class JobCancelled(Exception):
+    """Фоновая операция прервана между порциями, например при закрытии окна"""
+
+    @staticmethod
+    def check(cancel):
+        if cancel is not None and cancel.is_set():
+            raise JobCancelled("Операция прервана")
+
+
+_SQL_SPACE_RE = re.compile(r'\s+')
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_LIST_RE = re.compile(r'\?(?:\s*,\s*\?)+')
+
+class QueryStats:
+    """Вызовы, строки и гистограмма времени по нормализованному тексту запроса; медленные - в журнал с планом"""
+
+    BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+    def __init__(self, slow_ms=100, slow_log=None, keep=100):
+        self.slow_ms = slow_ms      # порог медленного запроса; None - не вести журнал
+        self.slow_log = slow_log    # файл, куда дописываются медленные запросы
+        self.statements = {}
+        self.slow = collections.deque(maxlen=keep)
+        self.actions = collections.deque(maxlen=keep)   # (действие, запросов, мс)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+            self.slow.clear()
+            self.actions.clear()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def normalize(query):
+        # Литералы и списки параметров не различаем: "IN (?, ?, ?)" и "IN (?, ?)" - один запрос
+        query = _SQL_LITERAL_RE.sub('?', _SQL_SPACE_RE.sub(' ', query).strip())
+        return _SQL_LIST_RE.sub('?, ...', query)
+
+    def record(self, conn, query, params, seconds, rows, many=False):
+        ms = seconds * 1000
+        key = self.normalize(query)
+        with self.lock:
+            stat = self.statements.get(key)
+            if stat is None:
+                stat = self.statements[key] = {'calls': 0, 'rows': 0, 'ms': 0.0, 'max_ms': 0.0,
+                                               'histogram': [0] * (len(self.BUCKETS_MS) + 1)}
+            stat['calls'] += 1
+            stat['rows'] += max(rows, 0)
+            stat['ms'] += ms
+            stat['max_ms'] = max(stat['max_ms'], ms)
+            stat['histogram'][bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        action = getattr(self.local, 'action', None)
+        if action is not None:
+            action[0] += 1
+            action[1] += ms
+        if self.slow_ms is not None and ms >= self.slow_ms:
+            self._log_slow(conn, key, query, params, ms, many)
+
+    def _log_slow(self, conn, key, query, params, ms, many):
+        plan = []
+        if not many:
+            try:
+                plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+            except sqlite3.Error:
+                pass    # у DDL и PRAGMA плана нет
+        entry = (time.strftime('%Y-%m-%d %H:%M:%S'), round(ms, 1), key, plan)
+        with self.lock:
+            self.slow.append(entry)
+            if self.slow_log:
+                with open(self.slow_log, 'a', encoding='utf-8') as f:
+                    f.write(f"{entry[0]} {entry[1]} мс: {key}\n" + ''.join(f"    {line}\n" for line in plan))
+
+    @contextmanager
+    def action(self, name):
+        """Учесть запросы, выполненные в этом потоке за время действия name"""
+        counter = self.local.action = [0, 0.0]
+        try:
+            yield counter
+        finally:
+            self.local.action = None
+            with self.lock:
+                self.actions.append((name, counter[0], round(counter[1], 1)))
+
+    def _percentile(self, histogram, share):
+        threshold, seen = sum(histogram) * share, 0
+        for bound, count in zip(self.BUCKETS_MS + (None,), histogram):
+            seen += count
+            if seen >= threshold:
+                return f"<{bound}" if bound is not None else f">{self.BUCKETS_MS[-1]}"
+
+    def top(self, limit=10):
+        """Самые затратные запросы: [(запрос, вызовов, строк, всего мс, среднее мс, максимум мс, p95)]"""
+        with self.lock:
+            stats = sorted(self.statements.items(), key=lambda item: item[1]['ms'], reverse=True)[:limit]
+            return [(query, stat['calls'], stat['rows'], round(stat['ms'], 1), round(stat['ms'] / stat['calls'], 2),
+                     round(stat['max_ms'], 1), self._percentile(stat['histogram'], 0.95)) for query, stat in stats]
+
+    def report(self, limit=10):
+        lines = [f"{total:>9.1f} мс {calls:>7} выз. {rows:>9} стр. ср. {avg:.2f} мс макс. {peak} мс p95 {p95} мс\n"
+                 f"    {query}" for query, calls, rows, total, avg, peak, p95 in self.top(limit)]
+        with self.lock:
+            for when, ms, query, plan in self.slow:
+                lines.append(f"Медленный запрос {when}, {ms} мс: {query}")
+                lines.extend(f"    {line}" for line in plan)
+        return '\n'.join(lines)
+
+QUERY_STATS = QueryStats()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор транзакции, учитывающий свои запросы в QUERY_STATS"""
+
+    def execute(self, query, params=()):
+        started = time.perf_counter()
+        super().execute(query, params)
+        QUERY_STATS.record(self.connection, query, params, time.perf_counter() - started, self.rowcount)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        started = time.perf_counter()
+        super().executemany(query, seq_of_params)
+        QUERY_STATS.record(self.connection, query, (), time.perf_counter() - started, self.rowcount, many=True)
+        return self
+
+
 class Database:
+    # Один долгоживущий писатель и небольшой пул читателей вместо соединения на каждый запрос
+    path = DB_PATH
+    pool_size = 4
+    pragmas = (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('cache_size', -64000),      # ~64 МБ страничного кэша
+        ('mmap_size', 268435456),    # 256 МБ отображения файла в память
+        ('temp_store', 'MEMORY'),
+    )
+    _writer = None
+    _write_lock = threading.RLock()
+    _readers = queue.LifoQueue()
+    _readers_opened = 0
+    _pool_lock = threading.Lock()
+    _listeners = {}
+
+    @staticmethod
+    def configure(path=DB_PATH, pool_size=4):
+        Database.close()
+        Database.path = path
+        Database.pool_size = pool_size
+
+    @staticmethod
+    def _connect():
+        # isolation_level=None: транзакциями управляем явно, одиночные запросы фиксируются сразу
+        conn = sqlite3.connect(Database.path, check_same_thread=False, isolation_level=None)
+        for name, value in Database.pragmas:
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @staticmethod
+    @contextmanager
+    def writer():
+        with Database._write_lock:
+            if Database._writer is None:
+                Database._writer = Database._connect()
+            yield Database._writer
+
+    @staticmethod
+    @contextmanager
+    def reader():
+        conn = None
+        try:
+            conn = Database._readers.get_nowait()
+        except queue.Empty:
+            with Database._pool_lock:
+                if Database._readers_opened < Database.pool_size:
+                    Database._readers_opened += 1
+                    try:
+                        conn = Database._connect()
+                    except sqlite3.Error:
+                        Database._readers_opened -= 1
+                        raise
+            if conn is None:
+                conn = Database._readers.get()
+        try:
+            yield conn
+        finally:
+            Database._readers.put(conn)
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        # Вложенный вызов присоединяется к уже открытой транзакции писателя
+        with Database.writer() as conn:
+            if conn.in_transaction:
+                yield conn.cursor(TimedCursor)
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor(TimedCursor)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    @staticmethod
+    def subscribe(table, callback):
+        Database._listeners.setdefault(table, []).append(callback)
+
+    @staticmethod
+    def notify(table, row_id=None):
+        # row_id - lastrowid вставленной строки; None - массовое изменение, нужна полная перезагрузка
+        for callback in list(Database._listeners.get(table, ())):
+            callback(row_id)
+
+    @staticmethod
+    def close():
+        with Database._write_lock:
+            if Database._writer is not None:
+                Database._writer.close()
+                Database._writer = None
+        with Database._pool_lock:
+            while True:
+                try:
+                    Database._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            Database._readers_opened = 0
+
     @staticmethod
     def init_db():
         try:
-            conn = sqlite3.connect('shop.db')
+            Database.create_schema()
+        except sqlite3.Error as e:
+            messagebox.showerror("Ошибка базы данных", f"Ошибка при инициализации базы данных: {e}")
+
+    @staticmethod
+    def create_schema():
+        with Database.writer() as conn:
             c = conn.cursor()
             c.execute('''CREATE TABLE IF NOT EXISTS clients (
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,37 +322,629 @@ class Database:
                             quantity INTEGER,
                             FOREIGN KEY(order_id) REFERENCES orders(id),
                             FOREIGN KEY(product_id) REFERENCES products(id))''')
-            conn.commit()
-            conn.close()
+        Database.migrate()
+
+    @staticmethod
+    def schema_version():
+        with Database.reader() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    @staticmethod
+    def migrate():
+        # Каждая миграция применяется в своей транзакции вместе с новым user_version
+        with Database.writer() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version > len(MIGRATIONS):
+                raise sqlite3.DatabaseError(f"версия схемы {version} новее поддерживаемой ({len(MIGRATIONS)})")
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                with Database.transaction() as cursor:
+                    migration(cursor)
+                    cursor.execute(f"PRAGMA user_version = {number}")
+            if version >= MIGRATIONS.index(migration_unique_constraints) + 1:
+                # Миграция уже прошла, но могла отложить уникальные индексы из-за повторов в данных
+                existing = {row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='index' AND sql LIKE 'CREATE UNIQUE INDEX%'")}
+                for name, table, columns in UNIQUE_INDEXES:
+                    if name not in existing:
+                        with Database.transaction() as cursor:
+                            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+                            _create_unique_index(cursor, name, table, columns)
+
+    @staticmethod
+    def archive_path():
+        return os.path.splitext(Database.path)[0] + '.archive.db'
+
+    @staticmethod
+    def attach_history(conn, create=False):
+        """Подключить архив к соединению и объявить history_orders/history_order_items; False - архива нет"""
+        archived = create or os.path.exists(Database.archive_path())
+        if archived:
+            conn.execute("ATTACH DATABASE ? AS archive", (Database.archive_path(),))
+            if create:
+                for statement in ARCHIVE_SCHEMA:
+                    conn.execute(statement)
+        for view, columns, table in HISTORY_VIEWS:
+            source = f"SELECT {columns} FROM main.{table}"
+            if archived:
+                source += f" UNION ALL SELECT {columns} FROM archive.{table}"
+            conn.execute(f"CREATE TEMP VIEW {view} AS {source}")
+        return archived
+
+    @staticmethod
+    def detach_history(conn, archived):
+        for view, _, _ in HISTORY_VIEWS:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{view}")
+        if archived:
+            conn.execute("DETACH DATABASE archive")
+
+    @staticmethod
+    @contextmanager
+    def history():
+        """Читатель, которому доступна архивная история; рабочие запросы архив не подключают"""
+        with Database.reader() as conn:
+            archived = Database.attach_history(conn)
+            try:
+                yield conn
+            finally:
+                Database.detach_history(conn, archived)
+
+    @staticmethod
+    def fetch_history(query, params=()):
+        try:
+            with Database.history() as conn:
+                started = time.perf_counter()
+                rows = conn.execute(query, params).fetchall()
+                QUERY_STATS.record(conn, query, params, time.perf_counter() - started, len(rows))
+                return rows
         except sqlite3.Error as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при инициализации базы данных: {e}")
+            raise DatabaseError(f"Ошибка базы данных: {e}", query) from e
+
+    @staticmethod
+    def rebuild_aggregates():
+        # Итоги по клиентам и периодам считаются за всю историю, включая архив
+        with Database.writer() as conn:
+            archived = Database.attach_history(conn)
+            try:
+                with Database.transaction() as cursor:
+                    rebuild_order_aggregates(cursor)
+            finally:
+                Database.detach_history(conn, archived)
+
+    @staticmethod
+    def verify_aggregates():
+        """Расхождения сводных таблиц с исходными данными: список (таблица, id)"""
+        return Database.fetch_history('''
+            WITH expected AS (
+                SELECT o.id AS order_id, o.client_id, o.created_at, COUNT(oi.order_id) AS items_count,
+                       COALESCE((SELECT fio FROM clients WHERE id = o.client_id), '') AS client_fio,
+                       COALESCE(SUM(oi.quantity * oi.price), 0) AS total
+                FROM orders o LEFT JOIN order_items oi ON oi.order_id = o.id
+                GROUP BY o.id
+            ), history_totals AS (
+                SELECT o.client_id, o.created_at, COALESCE(i.total, 0) AS total
+                FROM history_orders o LEFT JOIN (
+                    SELECT order_id, SUM(quantity * price) AS total FROM history_order_items GROUP BY order_id
+                ) i ON i.order_id = o.id
+            ), expected_clients AS (
+                SELECT client_id, COUNT(*) AS orders_count, SUM(total) AS total
+                FROM history_totals WHERE client_id IS NOT NULL GROUP BY client_id
+            ), expected_periods AS (
+                SELECT 'revenue_daily' AS rollup, substr(created_at, 1, 10) AS period,
+                       COUNT(*) AS orders_count, SUM(total) AS total
+                FROM history_totals WHERE created_at IS NOT NULL GROUP BY 2
+                UNION ALL
+                SELECT 'revenue_monthly', substr(created_at, 1, 7), COUNT(*), SUM(total)
+                FROM history_totals WHERE created_at IS NOT NULL GROUP BY 2
+            ), actual_periods AS (
+                SELECT 'revenue_daily' AS rollup, day AS period, orders_count, total FROM revenue_daily
+                UNION ALL
+                SELECT 'revenue_monthly', month, orders_count, total FROM revenue_monthly
+            )
+            SELECT 'order_totals', e.order_id FROM expected e
+            LEFT JOIN order_totals t ON t.order_id = e.order_id
+            WHERE t.order_id IS NULL OR t.client_id IS NOT e.client_id OR t.client_fio != e.client_fio
+               OR t.items_count != e.items_count OR ABS(t.total - e.total) > 0.005
+            UNION ALL
+            SELECT 'order_totals', order_id FROM order_totals
+            WHERE order_id NOT IN (SELECT id FROM orders)
+            UNION ALL
+            SELECT 'client_revenue', e.client_id FROM expected_clients e
+            LEFT JOIN client_revenue r ON r.client_id = e.client_id
+            WHERE r.client_id IS NULL OR r.orders_count != e.orders_count OR ABS(r.total - e.total) > 0.005
+            UNION ALL
+            SELECT 'client_revenue', client_id FROM client_revenue
+            WHERE (orders_count != 0 OR ABS(total) > 0.005)
+              AND client_id NOT IN (SELECT client_id FROM expected_clients)
+            UNION ALL
+            SELECT e.rollup, e.period FROM expected_periods e
+            LEFT JOIN actual_periods a ON a.rollup = e.rollup AND a.period = e.period
+            WHERE a.period IS NULL OR a.orders_count != e.orders_count OR ABS(a.total - e.total) > 0.005
+            UNION ALL
+            SELECT a.rollup, a.period FROM actual_periods a
+            WHERE (a.orders_count != 0 OR ABS(a.total) > 0.005) AND NOT EXISTS (
+                SELECT 1 FROM expected_periods e WHERE e.rollup = a.rollup AND e.period = a.period)
+        ''')
 
     @staticmethod
     def execute_query(query, params=()):
         try:
-            conn = sqlite3.connect('shop.db')
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            conn.commit()
-            result = cursor.lastrowid
-            conn.close()
-            return result
+            with Database.writer() as conn:
+                started = time.perf_counter()
+                cursor = conn.execute(query, params)
+                QUERY_STATS.record(conn, query, params, time.perf_counter() - started, cursor.rowcount)
+                return cursor.lastrowid
         except sqlite3.Error as e:
-            raise Exception(f"Ошибка базы данных: {e}")
+            raise DatabaseError(f"Ошибка базы данных: {e}", query) from e
 
     @staticmethod
     def fetch_all(query, params=()):
         try:
-            conn = sqlite3.connect('shop.db')
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            result = cursor.fetchall()
-            conn.close()
-            return result
+            with Database.reader() as conn:
+                started = time.perf_counter()
+                rows = conn.execute(query, params).fetchall()
+                QUERY_STATS.record(conn, query, params, time.perf_counter() - started, len(rows))
+                return rows
         except sqlite3.Error as e:
-            raise Exception(f"Ошибка базы данных: {e}")
+            raise DatabaseError(f"Ошибка базы данных: {e}", query) from e
+
+# --- Миграции схемы ---
+# Версия схемы хранится в PRAGMA user_version; новые миграции только дописываются в конец списка
+# Уникальные индексы: (имя, таблица, столбцы); при повторах в данных вместо них - обычный idx_* индекс
+UNIQUE_INDEXES = (('ux_clients_phone', 'clients', 'phone'), ('ux_products_name_unit', 'products', 'name, unit'))
+
+def _create_unique_index(cursor, name, table, columns):
+    # Уникальный индекс создаем, только если существующие данные это позволяют; NULL повторяться может
+    not_null = ' AND '.join(f"{column.strip()} IS NOT NULL" for column in columns.split(','))
+    duplicates = cursor.execute(
+        f"SELECT {columns}, COUNT(*) FROM {table} WHERE {not_null} GROUP BY {columns} HAVING COUNT(*) > 1 LIMIT 5"
+    ).fetchall()
+    fallback = 'idx_' + name[len('ux_'):]
+    if duplicates:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {fallback} ON {table}({columns})")
+        examples = '; '.join(', '.join(str(value) for value in row[:-1]) + f" ({row[-1]} раз)" for row in duplicates)
+        print(f"Уникальный индекс {name} не создан: в {table}({columns}) есть повторы, например {examples}. "
+              f"Он будет создан при запуске, когда повторы будут удалены", file=sys.stderr)
+        return False
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+    cursor.execute(f"DROP INDEX IF EXISTS {fallback}")
+    return True
+
+def migration_lookup_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_fio ON clients(fio)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_client_id ON orders(client_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items(product_id)")
+
+def migration_unique_constraints(cursor):
+    for name, table, columns in UNIQUE_INDEXES:
+        _create_unique_index(cursor, name, table, columns)
+
+# Сумма позиции по цене, зафиксированной на момент заказа
+_LINE_AMOUNT = "{row}.quantity * COALESCE({row}.price, (SELECT price FROM products WHERE id = {row}.product_id), 0)"
+
+# Пересчет одной строки order_totals по ее позициям - O(размер заказа)
+_RECOUNT_ORDER = '''
+    UPDATE order_totals SET
+        items = COALESCE((SELECT GROUP_CONCAT(COALESCE(p.name, '?') || ' x' || oi.quantity, ', ')
+                          FROM order_items oi LEFT JOIN products p ON p.id = oi.product_id
+                          WHERE oi.order_id = order_totals.order_id), ''),
+        items_count = (SELECT COUNT(*) FROM order_items WHERE order_id = order_totals.order_id),
+        total = COALESCE((SELECT SUM(quantity * price) FROM order_items WHERE order_id = order_totals.order_id), 0)
+    WHERE order_id IN ({ids});
+'''
+
+# Сводки выручки по периодам: (таблица, столбец периода, длина префикса created_at)
+_REVENUE_ROLLUPS = (('revenue_daily', 'day', 10), ('revenue_monthly', 'month', 7))
+
+# Архив заказов - отдельный файл, подключаемый через ATTACH только для отчетов по истории
+ARCHIVE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS archive.orders (
+        id INTEGER PRIMARY KEY, client_id INTEGER, created_at TEXT, total REAL NOT NULL DEFAULT 0)''',
+    '''CREATE TABLE IF NOT EXISTS archive.order_items (
+        order_id INTEGER, product_id INTEGER, quantity INTEGER, price REAL)''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_orders_client_id ON orders(client_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_order_items_order_id ON order_items(order_id)",
+)
+# Временные представления соединения: рабочие строки вместе с архивными
+HISTORY_VIEWS = (
+    ('history_orders', 'id, client_id, created_at', 'orders'),
+    ('history_order_items', 'order_id, product_id, quantity, price', 'order_items'),
+)
+
+# Перестроение сводных таблиц под текущую схему; миграции держат собственные замороженные копии.
+# Ожидает представления history_* (Database.attach_history): итоги клиентов и периодов включают архив
+def rebuild_order_aggregates(cursor):
+    cursor.execute("DELETE FROM order_totals")
+    cursor.execute("DELETE FROM client_revenue")
+    cursor.execute('''
+        INSERT INTO order_totals (order_id, client_id, client_fio, items, items_count, total)
+        SELECT o.id, o.client_id, COALESCE((SELECT fio FROM clients WHERE id = o.client_id), ''),
+               COALESCE(GROUP_CONCAT(COALESCE(p.name, '?') || ' x' || oi.quantity, ', '), ''),
+               COUNT(oi.order_id), COALESCE(SUM(oi.quantity * oi.price), 0)
+        FROM orders o
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        LEFT JOIN products p ON p.id = oi.product_id
+        GROUP BY o.id
+    ''')
+    history_totals = '''
+        SELECT o.client_id, o.created_at, COALESCE(i.total, 0) AS total
+        FROM history_orders o LEFT JOIN (
+            SELECT order_id, SUM(quantity * price) AS total FROM history_order_items GROUP BY order_id
+        ) i ON i.order_id = o.id
+    '''
+    cursor.execute(f'''
+        INSERT INTO client_revenue (client_id, orders_count, total)
+        SELECT client_id, COUNT(*), SUM(total) FROM ({history_totals})
+        WHERE client_id IS NOT NULL GROUP BY client_id
+    ''')
+    for table, column, width in _REVENUE_ROLLUPS:
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f'''
+            INSERT INTO {table} ({column}, orders_count, total)
+            SELECT substr(created_at, 1, {width}), COUNT(*), SUM(total) FROM ({history_totals})
+            WHERE created_at IS NOT NULL
+            GROUP BY 1
+        ''')
+
+def migration_order_aggregates(cursor):
+    # Цена фиксируется в позиции заказа, чтобы итоги не менялись вместе с прайсом
+    cursor.execute("ALTER TABLE order_items ADD COLUMN price REAL")
+    cursor.execute('''UPDATE order_items SET price = (SELECT price FROM products WHERE id = order_items.product_id)
+                      WHERE price IS NULL''')
+    cursor.execute('''CREATE TABLE order_totals (
+                        order_id INTEGER PRIMARY KEY,
+                        client_id INTEGER,
+                        items TEXT NOT NULL DEFAULT '',
+                        items_count INTEGER NOT NULL DEFAULT 0,
+                        total REAL NOT NULL DEFAULT 0)''')
+    cursor.execute("CREATE INDEX idx_order_totals_client_id ON order_totals(client_id)")
+    cursor.execute('''CREATE TABLE client_revenue (
+                        client_id INTEGER PRIMARY KEY,
+                        orders_count INTEGER NOT NULL DEFAULT 0,
+                        total REAL NOT NULL DEFAULT 0)''')
+    cursor.execute("CREATE INDEX idx_client_revenue_total ON client_revenue(total)")
+    cursor.execute('''
+        INSERT INTO order_totals (order_id, client_id, items, items_count, total)
+        SELECT o.id, o.client_id,
+               COALESCE(GROUP_CONCAT(COALESCE(p.name, '?') || ' x' || oi.quantity, ', '), ''),
+               COUNT(oi.order_id), COALESCE(SUM(oi.quantity * oi.price), 0)
+        FROM orders o
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        LEFT JOIN products p ON p.id = oi.product_id
+        GROUP BY o.id
+    ''')
+    cursor.execute('''
+        INSERT INTO client_revenue (client_id, orders_count, total)
+        SELECT client_id, COUNT(*), SUM(total) FROM order_totals
+        WHERE client_id IS NOT NULL GROUP BY client_id
+    ''')
+
+    cursor.execute('''CREATE TRIGGER trg_orders_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO order_totals (order_id, client_id) VALUES (NEW.id, NEW.client_id);
+        INSERT INTO client_revenue (client_id, orders_count) SELECT NEW.client_id, 1 WHERE NEW.client_id IS NOT NULL
+            ON CONFLICT(client_id) DO UPDATE SET orders_count = orders_count + 1;
+    END''')
+    cursor.execute('''CREATE TRIGGER trg_orders_delete AFTER DELETE ON orders BEGIN
+        UPDATE client_revenue SET orders_count = orders_count - 1,
+            total = total - COALESCE((SELECT total FROM order_totals WHERE order_id = OLD.id), 0)
+        WHERE client_id = OLD.client_id;
+        DELETE FROM order_totals WHERE order_id = OLD.id;
+    END''')
+    cursor.execute('''CREATE TRIGGER trg_orders_update_client AFTER UPDATE OF client_id ON orders BEGIN
+        UPDATE client_revenue SET orders_count = orders_count - 1,
+            total = total - (SELECT total FROM order_totals WHERE order_id = NEW.id)
+        WHERE client_id = OLD.client_id;
+        INSERT INTO client_revenue (client_id, orders_count, total)
+            SELECT NEW.client_id, 1, total FROM order_totals WHERE order_id = NEW.id AND NEW.client_id IS NOT NULL
+            ON CONFLICT(client_id) DO UPDATE SET orders_count = orders_count + 1, total = total + excluded.total;
+        UPDATE order_totals SET client_id = NEW.client_id WHERE order_id = NEW.id;
+    END''')
+    # Позиции меняют выручку клиента через order_totals.client_id: если заказ уже удален, двойного вычета нет
+    cursor.execute(f'''CREATE TRIGGER trg_order_items_insert AFTER INSERT ON order_items BEGIN
+        UPDATE order_items SET price = (SELECT price FROM products WHERE id = NEW.product_id)
+        WHERE rowid = NEW.rowid AND NEW.price IS NULL;
+        UPDATE order_totals SET
+            items = items || CASE WHEN items = '' THEN '' ELSE ', ' END
+                    || COALESCE((SELECT name FROM products WHERE id = NEW.product_id), '?') || ' x' || NEW.quantity,
+            items_count = items_count + 1,
+            total = total + {_LINE_AMOUNT.format(row='NEW')}
+        WHERE order_id = NEW.order_id;
+        UPDATE client_revenue SET total = total + {_LINE_AMOUNT.format(row='NEW')}
+        WHERE client_id = (SELECT client_id FROM order_totals WHERE order_id = NEW.order_id);
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_order_items_delete AFTER DELETE ON order_items BEGIN
+        {_RECOUNT_ORDER.format(ids='OLD.order_id')}
+        UPDATE client_revenue SET total = total - {_LINE_AMOUNT.format(row='OLD')}
+        WHERE client_id = (SELECT client_id FROM order_totals WHERE order_id = OLD.order_id);
+    END''')
+    # Заполнение цены вставочным триггером (NULL -> цена товара) итогов не меняет
+    cursor.execute(f'''CREATE TRIGGER trg_order_items_update AFTER UPDATE OF order_id, product_id, quantity, price ON order_items
+    WHEN OLD.price IS NOT NULL OR OLD.quantity IS NOT NEW.quantity
+         OR OLD.product_id IS NOT NEW.product_id OR OLD.order_id IS NOT NEW.order_id BEGIN
+        {_RECOUNT_ORDER.format(ids='OLD.order_id, NEW.order_id')}
+        UPDATE client_revenue SET total = total - {_LINE_AMOUNT.format(row='OLD')}
+        WHERE client_id = (SELECT client_id FROM order_totals WHERE order_id = OLD.order_id);
+        UPDATE client_revenue SET total = total + {_LINE_AMOUNT.format(row='NEW')}
+        WHERE client_id = (SELECT client_id FROM order_totals WHERE order_id = NEW.order_id);
+    END''')
+
+def migration_order_sort_keys(cursor):
+    # Ключи сортировки списка заказов лежат в order_totals, чтобы ORDER BY шел по индексу без соединений
+    cursor.execute("ALTER TABLE order_totals ADD COLUMN client_fio TEXT NOT NULL DEFAULT ''")
+    cursor.execute("UPDATE order_totals SET client_fio = COALESCE((SELECT fio FROM clients WHERE id = client_id), '')")
+    cursor.execute("CREATE INDEX idx_order_totals_client_fio ON order_totals(client_fio, order_id)")
+    cursor.execute("CREATE INDEX idx_order_totals_items_count ON order_totals(items_count, order_id)")
+    cursor.execute("CREATE INDEX idx_order_totals_total ON order_totals(total, order_id)")
+    cursor.execute("DROP TRIGGER trg_orders_insert")
+    cursor.execute('''CREATE TRIGGER trg_orders_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO order_totals (order_id, client_id, client_fio)
+        VALUES (NEW.id, NEW.client_id, COALESCE((SELECT fio FROM clients WHERE id = NEW.client_id), ''));
+        INSERT INTO client_revenue (client_id, orders_count) SELECT NEW.client_id, 1 WHERE NEW.client_id IS NOT NULL
+            ON CONFLICT(client_id) DO UPDATE SET orders_count = orders_count + 1;
+    END''')
+    cursor.execute('''CREATE TRIGGER trg_orders_update_client_fio AFTER UPDATE OF client_id ON orders BEGIN
+        UPDATE order_totals SET client_fio = COALESCE((SELECT fio FROM clients WHERE id = NEW.client_id), '')
+        WHERE order_id = NEW.id;
+    END''')
+    cursor.execute('''CREATE TRIGGER trg_clients_update_fio AFTER UPDATE OF fio ON clients BEGIN
+        UPDATE order_totals SET client_fio = COALESCE(NEW.fio, '') WHERE client_id = NEW.id;
+    END''')
+
+def _create_fts_index(cursor, table, columns):
+    # Внешний контент: FTS5 хранит только индекс, сами строки остаются в исходной таблице
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{c}' for c in columns)
+    old_values = ', '.join(f'OLD.{c}' for c in columns)
+    cursor.execute(f'''CREATE VIRTUAL TABLE {table}_fts USING fts5({column_list},
+                        content='{table}', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2', prefix='2 3')''')
+    cursor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES('rebuild')")
+    cursor.execute(f'''CREATE TRIGGER trg_{table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts(rowid, {column_list}) VALUES (NEW.id, {new_values});
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_{table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_{table}_fts_update AFTER UPDATE ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+        INSERT INTO {table}_fts(rowid, {column_list}) VALUES (NEW.id, {new_values});
+    END''')
+
+def migration_full_text_search(cursor):
+    _create_fts_index(cursor, 'clients', ('fio', 'phone', 'email', 'address'))
+    _create_fts_index(cursor, 'products', ('name', 'unit'))
+
+def migration_client_city(cursor):
+    cursor.execute("ALTER TABLE clients ADD COLUMN city TEXT")
+    cursor.execute("ALTER TABLE clients ADD COLUMN region TEXT")
+    # Полнотекстовый индекс не зависит от города: переиндексация только при смене исходных полей
+    cursor.execute("DROP TRIGGER trg_clients_fts_update")
+    cursor.execute('''CREATE TRIGGER trg_clients_fts_update AFTER UPDATE OF fio, phone, email, address ON clients BEGIN
+        INSERT INTO clients_fts(clients_fts, rowid, fio, phone, email, address)
+        VALUES ('delete', OLD.id, OLD.fio, OLD.phone, OLD.email, OLD.address);
+        INSERT INTO clients_fts(rowid, fio, phone, email, address) VALUES (NEW.id, NEW.fio, NEW.phone, NEW.email, NEW.address);
+    END''')
+    last_id = 0
+    while True:
+        rows = cursor.execute("SELECT id, address FROM clients WHERE id > ? ORDER BY id LIMIT 5000", (last_id,)).fetchall()
+        if not rows:
+            break
+        cursor.executemany("UPDATE clients SET city=?, region=? WHERE id=?",
+                           [parse_address(address) + (client_id,) for client_id, address in rows])
+        last_id = rows[-1][0]
+    cursor.execute("CREATE INDEX idx_clients_city ON clients(city)")
+
+def migration_analytics_state(cursor):
+    # Счетчики изменений, которые нельзя уловить по росту max(id): удаления и правки
+    cursor.execute('''CREATE TABLE analytics_state (
+                        name TEXT PRIMARY KEY,
+                        value INTEGER NOT NULL DEFAULT 0)''')
+    cursor.execute("INSERT INTO analytics_state (name) VALUES ('order_mutations'), ('client_mutations')")
+    bump = "UPDATE analytics_state SET value = value + 1 WHERE name = '{}';"
+    for trigger, event, counter in (
+        ('trg_analytics_orders_delete', 'AFTER DELETE ON orders', 'order_mutations'),
+        ('trg_analytics_orders_update', 'AFTER UPDATE OF client_id ON orders', 'order_mutations'),
+        ('trg_analytics_order_items_delete', 'AFTER DELETE ON order_items', 'order_mutations'),
+        # Заполнение цены при вставке позиции изменением не считается
+        ('trg_analytics_order_items_update', '''AFTER UPDATE OF order_id, product_id, quantity, price ON order_items
+            WHEN OLD.price IS NOT NULL OR OLD.quantity IS NOT NEW.quantity
+                 OR OLD.product_id IS NOT NEW.product_id OR OLD.order_id IS NOT NEW.order_id''', 'order_mutations'),
+        ('trg_analytics_clients_delete', 'AFTER DELETE ON clients', 'client_mutations'),
+        ('trg_analytics_clients_update', 'AFTER UPDATE OF city ON clients', 'client_mutations'),
+    ):
+        cursor.execute(f"CREATE TRIGGER {trigger} {event} BEGIN {bump.format(counter)} END")
+
+def _rollup_add(created, orders, amount, source):
+    """Прибавить к сводкам периода даты created число заказов orders и сумму amount"""
+    return '\n'.join(f'''
+        INSERT INTO {table} ({column}, orders_count, total)
+            SELECT substr({created}, 1, {width}), {orders}, {amount} {source}
+            ON CONFLICT({column}) DO UPDATE SET orders_count = orders_count + excluded.orders_count,
+                                                total = total + excluded.total;'''
+                      for table, column, width in _REVENUE_ROLLUPS)
+
+_ORDER_ITEMS_AMOUNT = "(SELECT COALESCE(SUM(quantity * price), 0) FROM order_items WHERE order_id = {id})"
+
+def migration_order_dates(cursor):
+    # Время заказа раньше не хранилось: существующие заказы датируются моментом миграции
+    cursor.execute("ALTER TABLE orders ADD COLUMN created_at TEXT")
+    cursor.execute("UPDATE orders SET created_at = datetime('now', 'localtime') WHERE created_at IS NULL")
+    cursor.execute("CREATE INDEX idx_orders_created_at ON orders(created_at)")
+    for table, column, width in _REVENUE_ROLLUPS:
+        cursor.execute(f'''CREATE TABLE {table} (
+                            {column} TEXT PRIMARY KEY,
+                            orders_count INTEGER NOT NULL DEFAULT 0,
+                            total REAL NOT NULL DEFAULT 0)''')
+        cursor.execute(f'''
+            INSERT INTO {table} ({column}, orders_count, total)
+            SELECT substr(o.created_at, 1, {width}), COUNT(*), SUM(COALESCE(t.total, 0))
+            FROM orders o LEFT JOIN order_totals t ON t.order_id = o.id
+            WHERE o.created_at IS NOT NULL
+            GROUP BY 1
+        ''')
+
+    # Заказ учитывается в сводке своего дня при вставке, суммы позиций - по мере их добавления
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_orders_insert AFTER INSERT ON orders BEGIN
+        {_rollup_add('NEW.created_at', 1, 0, 'WHERE NEW.created_at IS NOT NULL')}
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_orders_delete AFTER DELETE ON orders BEGIN
+        {_rollup_add('OLD.created_at', -1, '-' + _ORDER_ITEMS_AMOUNT.format(id='OLD.id'),
+                     'WHERE OLD.created_at IS NOT NULL')}
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_orders_update_date AFTER UPDATE OF created_at ON orders
+    WHEN OLD.created_at IS NOT NEW.created_at BEGIN
+        {_rollup_add('OLD.created_at', -1, '-' + _ORDER_ITEMS_AMOUNT.format(id='OLD.id'),
+                     'WHERE OLD.created_at IS NOT NULL')}
+        {_rollup_add('NEW.created_at', 1, _ORDER_ITEMS_AMOUNT.format(id='NEW.id'), 'WHERE NEW.created_at IS NOT NULL')}
+    END''')
+    item_order = "FROM orders o WHERE o.id = {row}.order_id AND o.created_at IS NOT NULL"
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_order_items_insert AFTER INSERT ON order_items BEGIN
+        {_rollup_add('o.created_at', 0, _LINE_AMOUNT.format(row='NEW'), item_order.format(row='NEW'))}
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_order_items_delete AFTER DELETE ON order_items BEGIN
+        {_rollup_add('o.created_at', 0, '-' + _LINE_AMOUNT.format(row='OLD'), item_order.format(row='OLD'))}
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_order_items_update AFTER UPDATE OF order_id, product_id, quantity, price ON order_items
+    WHEN OLD.price IS NOT NULL OR OLD.quantity IS NOT NEW.quantity
+         OR OLD.product_id IS NOT NEW.product_id OR OLD.order_id IS NOT NEW.order_id BEGIN
+        {_rollup_add('o.created_at', 0, '-' + _LINE_AMOUNT.format(row='OLD'), item_order.format(row='OLD'))}
+        {_rollup_add('o.created_at', 0, _LINE_AMOUNT.format(row='NEW'), item_order.format(row='NEW'))}
+    END''')
+
+def migration_archive_guard(cursor):
+    # Пока идет архивация, удаление заказов не уменьшает итоги клиентов и сводки выручки за всю историю
+    cursor.execute("CREATE TABLE archive_state (active INTEGER NOT NULL DEFAULT 0)")
+    cursor.execute("INSERT INTO archive_state (active) VALUES (0)")
+    guard = "WHEN NOT (SELECT active FROM archive_state)"
+    for trigger in ('trg_orders_delete', 'trg_order_items_delete',
+                    'trg_rollup_orders_delete', 'trg_rollup_order_items_delete'):
+        cursor.execute(f"DROP TRIGGER {trigger}")
+    cursor.execute(f'''CREATE TRIGGER trg_orders_delete AFTER DELETE ON orders {guard} BEGIN
+        UPDATE client_revenue SET orders_count = orders_count - 1,
+            total = total - COALESCE((SELECT total FROM order_totals WHERE order_id = OLD.id), 0)
+        WHERE client_id = OLD.client_id;
+        DELETE FROM order_totals WHERE order_id = OLD.id;
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_order_items_delete AFTER DELETE ON order_items {guard} BEGIN
+        {_RECOUNT_ORDER.format(ids='OLD.order_id')}
+        UPDATE client_revenue SET total = total - {_LINE_AMOUNT.format(row='OLD')}
+        WHERE client_id = (SELECT client_id FROM order_totals WHERE order_id = OLD.order_id);
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_orders_delete AFTER DELETE ON orders {guard} BEGIN
+        {_rollup_add('OLD.created_at', -1, '-' + _ORDER_ITEMS_AMOUNT.format(id='OLD.id'),
+                     'WHERE OLD.created_at IS NOT NULL')}
+    END''')
+    cursor.execute(f'''CREATE TRIGGER trg_rollup_order_items_delete AFTER DELETE ON order_items {guard} BEGIN
+        {_rollup_add('o.created_at', 0, '-' + _LINE_AMOUNT.format(row='OLD'),
+                     'FROM orders o WHERE o.id = OLD.order_id AND o.created_at IS NOT NULL')}
+    END''')
+
+MIGRATIONS = [
+    migration_lookup_indexes,
+    migration_unique_constraints,
+    migration_order_aggregates,
+    migration_order_sort_keys,
+    migration_full_text_search,
+    migration_client_city,
+    migration_analytics_state,
+    migration_order_dates,
+    migration_archive_guard,
+]
+
+# --- Кэш справочников ---
+class CatalogCache:
+    """LRU-кэш строк справочника по id: заполняется одним запросом, недостающие строки дочитывает get.
+    Запись клиента или товара кладет строку сюда же, массовая загрузка сбрасывает кэш"""
+
+    def __init__(self, table, columns, capacity=10000):
+        self.table = table
+        self.columns = columns
+        self.capacity = capacity
+        self.rows = collections.OrderedDict()
+        self.complete = False   # в кэше весь справочник: fill обходится без запроса
+        self.generation = 0     # меняется при сбросе, чтобы fill не пометил полным уже сброшенный кэш
+        self.lock = threading.Lock()
+
+    def fill(self, limit=None):
+        """Первые limit строк справочника [(id, *columns)]; пока справочник помещается в кэш, читаются из памяти"""
+        limit = limit or self.capacity
+        with self.lock:
+            if self.complete:
+                return [(row_id,) + row for row_id, row in sorted(self.rows.items())[:limit]]
+            generation = self.generation
+        rows = Database.fetch_all(
+            f"SELECT id, {', '.join(self.columns)} FROM {self.table} ORDER BY id LIMIT ?", (limit,)
+        )
+        self.put(rows)
+        with self.lock:
+            if generation == self.generation and len(rows) < limit <= self.capacity:
+                self.complete = True
+        return rows
+
+    def put(self, rows):
+        with self.lock:
+            for row in rows:
+                self.rows[row[0]] = tuple(row[1:])
+                self.rows.move_to_end(row[0])
+            while len(self.rows) > self.capacity:
+                self.rows.popitem(last=False)
+                self.complete = False
+
+    def get(self, row_id):
+        with self.lock:
+            row = self.rows.get(row_id)
+            if row is not None:
+                self.rows.move_to_end(row_id)
+                return row
+        rows = Database.fetch_all(f"SELECT id, {', '.join(self.columns)} FROM {self.table} WHERE id=?", (row_id,))
+        self.put(rows)
+        return tuple(rows[0][1:]) if rows else None
+
+    def clear(self):
+        with self.lock:
+            self.rows.clear()
+            self.complete = False
+            self.generation += 1
+
+CLIENTS_CACHE = CatalogCache('clients', ('fio', 'phone'))
+PRODUCTS_CACHE = CatalogCache('products', ('name', 'price', 'unit'))
+
+# --- Разбор адреса ---
+_POSTCODE_RE = re.compile(r'^\d{6}$')
+_COUNTRY_RE = re.compile(r'^(россия|рф|российская федерация)$', re.IGNORECASE)
+_REGION_RE = re.compile(r'(\bобл\.?|\bобласть|\bкрай|\bресп\.?|\bреспублика|\bАО\b|автономный округ)', re.IGNORECASE)
+_CITY_PREFIX_RE = re.compile(r'^(г\.|г\s|город\s)\s*', re.IGNORECASE)
+_STREET_RE = re.compile(r'^(ул|улица|пр|пр-т|проспект|пер|переулок|ш|шоссе|наб|набережная|б-р|бул|бульвар|пл|площадь|д|дом|кв|стр|корп|мкр)\b\.?', re.IGNORECASE)
+_FEDERAL_CITIES = {'москва', 'санкт-петербург', 'севастополь'}
+
+def parse_address(address):
+    """Город и регион из свободной строки адреса: (city, region), неизвестное - None"""
+    city = region = None
+    parts = [part.strip(' .') for part in (address or '').split(',')]
+    parts = [part for part in parts if part and not _POSTCODE_RE.match(part) and not _COUNTRY_RE.match(part)]
+    if len(parts) == 1:
+        # Адрес без запятых: город - первое слово (или слово после "г.")
+        words = _CITY_PREFIX_RE.sub('', parts[0]).split()
+        parts = [words[0]] if words and not _STREET_RE.match(words[0]) else []
+    for part in parts:
+        if region is None and _REGION_RE.search(part):
+            region = part
+        elif city is None and _CITY_PREFIX_RE.match(part):
+            city = _CITY_PREFIX_RE.sub('', part)
+    if city is None:
+        city = next((part for part in parts
+                     if part != region and not _STREET_RE.match(part) and not part[0].isdigit()), None)
+    if city:
+        city = city[0].upper() + city[1:]
+        if region is None and city.lower() in _FEDERAL_CITIES:
+            region = city
+    return city or None, region
 
 # --- Класс Клиента ---
+PHONE_RE = re.compile(r'^9\d{9}$')
+EMAIL_RE = re.compile(r'^[^@]+@[^@]+\.[^@]+$')
+
 class Client:
     def __init__(self, fio="", phone="", email="", address=""):
         self.fio = fio
@@ -71,18 +955,27 @@ class Client:
     def validate(self):
         if not all([self.fio, self.phone, self.email, self.address]):
             raise ValueError("Заполните все поля")
-        if not re.match(r'^9\d{9}$', self.phone):
+        if not PHONE_RE.match(self.phone):
             raise ValueError("Телефон должен начинаться на 9 и содержать 10 цифр (без +7 и 8)")
-        if not re.match(r'^[^@]+@[^@]+\.[^@]+$', self.email):
+        if not EMAIL_RE.match(self.email):
             raise ValueError("Некорректный формат почты")
         return True
     
     def save(self):
         self.validate()
-        Database.execute_query(
-            "INSERT INTO clients (fio, phone, email, address) VALUES (?, ?, ?, ?)",
-            (self.fio, self.phone, self.email, self.address)
-        )
+        city, region = parse_address(self.address)
+        try:
+            client_id = Database.execute_query(
+                "INSERT INTO clients (fio, phone, email, address, city, region) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.fio, self.phone, self.email, self.address, city, region)
+            )
+        except DatabaseError as e:
+            if isinstance(e.__cause__, sqlite3.IntegrityError):
+                raise ValueError(f"Клиент с телефоном {self.phone} уже есть") from e
+            raise
+        CLIENTS_CACHE.put([(client_id, self.fio, self.phone)])
+        Database.notify('clients', client_id)
+        return client_id
 
 # --- Класс Товара ---
 class Product:
@@ -100,38 +993,884 @@ class Product:
     
     def save(self):
         self.validate()
-        Database.execute_query(
-            "INSERT INTO products (name, price, unit) VALUES (?, ?, ?)",
-            (self.name, self.price, self.unit)
-        )
+        try:
+            product_id = Database.execute_query(
+                "INSERT INTO products (name, price, unit) VALUES (?, ?, ?)",
+                (self.name, self.price, self.unit)
+            )
+        except DatabaseError as e:
+            if isinstance(e.__cause__, sqlite3.IntegrityError):
+                raise ValueError(f"Товар {self.name} ({self.unit}) уже есть") from e
+            raise
+        PRODUCTS_CACHE.put([(product_id, self.name, self.price, self.unit)])
+        Database.notify('products', product_id)
+        return product_id
 
 # --- Класс Заказа ---
+# Цена товара копируется в позицию в момент заказа
+# Время заказа - локальное, в формате ГГГГ-ММ-ДД ЧЧ:ММ:СС; без явного значения берется текущее
+ORDER_INSERT = "INSERT INTO orders (client_id, created_at) VALUES (?, COALESCE(?, datetime('now', 'localtime')))"
+ORDER_ITEM_INSERT = '''INSERT INTO order_items (order_id, product_id, quantity, price)
+                       VALUES (?, ?, ?, (SELECT price FROM products WHERE id = ?))'''
+
 class Order:
     def __init__(self):
         self.client_id = None
+        self.created_at = None
         self.items = []
     
     def add_item(self, product_id, quantity):
         self.items.append((product_id, quantity))
     
-    def save(self):
+    def validate(self):
         if not self.client_id:
             raise ValueError("Не выбран клиент")
         if not self.items:
             raise ValueError("Нет товаров в заказе")
-        
-        # Создаем заказ
-        order_id = Database.execute_query(
-            "INSERT INTO orders (client_id) VALUES (?)",
-            (self.client_id,)
+        return True
+
+    def save(self):
+        self.validate()
+        try:
+            # Шапка и все позиции заказа - одна транзакция
+            with Database.transaction() as cursor:
+                order_id = self._insert(cursor)
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Ошибка базы данных: {e}") from e
+        Database.notify('orders', order_id)
+        return order_id
+
+    def _insert(self, cursor):
+        cursor.execute(ORDER_INSERT, (self.client_id, self.created_at))
+        order_id = cursor.lastrowid
+        cursor.executemany(ORDER_ITEM_INSERT, [(order_id, product_id, quantity, product_id)
+                                               for product_id, quantity in self.items])
+        return order_id
+
+    @staticmethod
+    def save_many(orders, chunk_size=1000):
+        """Пакетная загрузка заказов одной транзакцией: сохраняются все заказы или ни одного.
+        chunk_size задает только размер пакета позиций для executemany"""
+        orders = list(orders)
+        # Проверяем всё заранее, чтобы ошибка в данных не прерывала транзакцию на середине
+        for order in orders:
+            order.validate()
+        order_ids = []
+        try:
+            with Database.transaction() as cursor:
+                for start in range(0, len(orders), chunk_size):
+                    items = []
+                    for order in orders[start:start + chunk_size]:
+                        cursor.execute(ORDER_INSERT, (order.client_id, order.created_at))
+                        order_id = cursor.lastrowid
+                        order_ids.append(order_id)
+                        items.extend((order_id, product_id, quantity, product_id)
+                                     for product_id, quantity in order.items)
+                    cursor.executemany(ORDER_ITEM_INSERT, items)
+        except sqlite3.Error as e:
+            # Транзакция откачена целиком: ни один заказ пакета не сохранен
+            raise DatabaseError(f"Ошибка базы данных: {e}") from e
+        if order_ids:
+            Database.notify('orders')
+        return order_ids
+
+# --- Полнотекстовый поиск ---
+_SEARCH_TOKEN_RE = re.compile(r'\w+')
+
+class Search:
+    # Каждое слово запроса - префикс, слова объединяются через AND; результаты по рангу bm25
+    @staticmethod
+    def match_query(text):
+        return ' '.join(f'"{token}"*' for token in _SEARCH_TOKEN_RE.findall(text))
+
+    @staticmethod
+    def filter(table, text):
+        """Условие и параметры для KeysetPager; пустой запрос снимает фильтр"""
+        query = Search.match_query(text)
+        if not query:
+            return '', ()
+        return f"id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?)", (query,)
+
+    @staticmethod
+    def clients(text, limit=20):
+        query = Search.match_query(text)
+        if not query:
+            return []
+        return Database.fetch_all('''
+            SELECT c.id, c.fio, c.phone FROM clients_fts f JOIN clients c ON c.id = f.rowid
+            WHERE clients_fts MATCH ? ORDER BY f.rank LIMIT ?
+        ''', (query, limit))
+
+    @staticmethod
+    def products(text, limit=50):
+        query = Search.match_query(text)
+        if not query:
+            return []
+        return Database.fetch_all('''
+            SELECT p.id, p.name, p.price, p.unit FROM products_fts f JOIN products p ON p.id = f.rowid
+            WHERE products_fts MATCH ? ORDER BY f.rank LIMIT ?
+        ''', (query, limit))
+
+
+# --- Аналитика с кэшем по водяному знаку ---
+class Analytics:
+    """Кэш агрегатов статистики: пока данные только дописываются, досчитывается лишь прирост"""
+
+    OUTCOMES = {'hit': "попадание в кэш", 'fold': "досчет прироста", 'miss': "полный пересчет"}
+
+    def __init__(self):
+        self.cache = {}     # имя -> (водяной знак, значение)
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.stats.clear()
+
+    @staticmethod
+    def order_watermark():
+        return Database.fetch_all('''
+            SELECT (SELECT value FROM analytics_state WHERE name = 'order_mutations'),
+                   COALESCE((SELECT MAX(id) FROM orders), 0), COALESCE((SELECT MAX(rowid) FROM order_items), 0)
+        ''')[0]
+
+    @staticmethod
+    def client_watermark():
+        return Database.fetch_all('''
+            SELECT (SELECT value FROM analytics_state WHERE name = 'client_mutations'),
+                   COALESCE((SELECT MAX(id) FROM clients), 0)
+        ''')[0]
+
+    def _cached(self, name, watermark, recompute, fold):
+        with self.lock:
+            started = time.perf_counter()
+            current = watermark()
+            entry = self.cache.get(name)
+            if entry is not None and entry[0] == current:
+                outcome, value = 'hit', entry[1]
+            elif entry is not None and entry[0][0] == current[0]:
+                # Счетчик изменений тот же - строки только добавлялись после прошлого знака
+                outcome, value = 'fold', fold(entry[0], current, entry[1])
+            else:
+                outcome, value = 'miss', recompute()
+            self.cache[name] = (current, value)
+            stat = self.stats.setdefault(name, {'hit': 0, 'fold': 0, 'miss': 0})
+            stat[outcome] += 1
+            stat['last'] = outcome
+            stat['ms'] = (time.perf_counter() - started) * 1000
+        return value
+
+    def summary(self, name):
+        stat = self.stats.get(name)
+        if stat is None:
+            return ""
+        return (f"{self.OUTCOMES[stat['last']]}, {stat['ms']:.1f} мс "
+                f"(попаданий {stat['hit']}, досчетов {stat['fold']}, пересчетов {stat['miss']})")
+
+    def top_clients(self, limit=5):
+        """[(fio, total)] лучших клиентов по выручке; Top-N отбирается в SQL"""
+        def recompute():
+            return Database.fetch_all("SELECT client_id, total FROM client_revenue ORDER BY total DESC LIMIT ?", (limit,))
+
+        def fold(previous, current, top):
+            # Суммы растут только у клиентов с новыми позициями - читаем их итоги и сливаем с прежним топом
+            touched = Database.fetch_all('''
+                SELECT client_id, total FROM client_revenue WHERE client_id IN (
+                    SELECT DISTINCT o.client_id FROM order_items oi JOIN orders o ON o.id = oi.order_id
+                    WHERE oi.rowid > ? AND oi.rowid <= ?)
+            ''', (previous[2], current[2]))
+            merged = dict(top)
+            merged.update(touched)
+            return sorted(merged.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+        top = self._cached(('top_clients', limit), self.order_watermark, recompute, fold)
+        names = dict(Database.fetch_all(
+            f"SELECT id, fio FROM clients WHERE id IN ({', '.join('?' * len(top))})", [client_id for client_id, _ in top]
+        )) if top else {}
+        return [(names.get(client_id, '?'), total) for client_id, total in top]
+
+    def geography(self):
+        """[(город, число клиентов)] по убыванию числа клиентов"""
+        query = '''SELECT COALESCE(city, 'Не определен'), COUNT(*) FROM clients {} GROUP BY city'''
+
+        def fold(previous, current, counts):
+            counts = dict(counts)
+            for city, count in Database.fetch_all(query.format("WHERE id > ? AND id <= ?"), (previous[1], current[1])):
+                counts[city] = counts.get(city, 0) + count
+            return counts
+
+        counts = self._cached('geography', self.client_watermark, lambda: dict(Database.fetch_all(query.format(''))), fold)
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    PERIODS = {column: (table, width) for table, column, width in _REVENUE_ROLLUPS}
+
+    @staticmethod
+    def period_bounds(start, end, period='day'):
+        """Проверенные границы периода в ключах сводки: (таблица, от, до)"""
+        if period not in Analytics.PERIODS:
+            raise ValueError(f"Неизвестный период: {period}")
+        try:
+            start, end = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+        except ValueError:
+            raise ValueError("Дата должна быть в формате ГГГГ-ММ-ДД")
+        if start > end:
+            raise ValueError("Начало периода позже конца")
+        table, width = Analytics.PERIODS[period]
+        return table, start.isoformat()[:width], end.isoformat()[:width]
+
+    @staticmethod
+    def revenue(start, end, period='day'):
+        """[(период, заказов, выручка)] за даты start..end (ГГГГ-ММ-ДД) включительно - только из сводок"""
+        table, start, end = Analytics.period_bounds(start, end, period)
+        return Database.fetch_all(
+            f"SELECT {period}, orders_count, total FROM {table} "
+            f"WHERE {period} BETWEEN ? AND ? AND orders_count > 0 ORDER BY {period}", (start, end)
         )
-        
-        # Добавляем товары в заказ
-        for product_id, quantity in self.items:
-            Database.execute_query(
-                "INSERT INTO order_items (order_id, product_id, quantity) VALUES (?, ?, ?)",
-                (order_id, product_id, quantity)
-            )
+
+ANALYTICS = Analytics()
+
+
+# --- Потоковый импорт из CSV ---
+ImportStats = collections.namedtuple('ImportStats', 'processed imported rejected seconds')
+
+class CsvImporter:
+    """Построчный импорт клиентов или товаров: проверка и вставка порциями, отклоненные строки - в отчет"""
+
+    TABLES = {
+        'clients': (('fio', 'phone', 'email', 'address'),
+                    "INSERT INTO clients (fio, phone, email, address, city, region) VALUES (?, ?, ?, ?, ?, ?)"),
+        'products': (('name', 'price', 'unit'),
+                     "INSERT INTO products (name, price, unit) VALUES (?, ?, ?)"),
+    }
+
+    def __init__(self, table, batch_size=1000, progress=None, cancel=None):
+        if table not in self.TABLES:
+            raise ValueError(f"Импорт в таблицу {table} не поддерживается")
+        self.table = table
+        self.columns, self.insert_sql = self.TABLES[table]
+        self.batch_size = batch_size
+        self.progress = progress    # progress(ImportStats) после каждой порции
+        self.cancel = cancel        # threading.Event: проверяется перед каждой порцией, уже загруженные остаются
+
+    def _validate(self, record):
+        values = [(record.get(column) or '').strip() for column in self.columns]
+        if self.table == 'clients':
+            Client(*values).validate()
+            values.extend(parse_address(values[3]))
+        else:
+            try:
+                values[1] = float(values[1].replace(',', '.'))
+            except ValueError:
+                raise ValueError("Стоимость должна быть числом >= 0")
+            Product(values[0], values[1], values[2]).validate()
+        return tuple(values)
+
+    def _insert(self, batch, rejects):
+        rows = [values for _, _, values in batch]
+        try:
+            with Database.transaction() as cursor:
+                cursor.executemany(self.insert_sql, rows)
+            return len(rows)
+        except sqlite3.IntegrityError:
+            pass
+        # В порции есть нарушение ограничений: повторяем построчно, отклоняя только плохие строки
+        inserted = 0
+        with Database.transaction() as cursor:
+            for line, record, values in batch:
+                try:
+                    cursor.execute(self.insert_sql, values)
+                    inserted += 1
+                except sqlite3.IntegrityError as e:
+                    rejects(line, record, f"Ошибка базы данных: {e}")
+        return inserted
+
+    @staticmethod
+    def reject_path_for(source_path):
+        return os.path.splitext(source_path)[0] + '.rejects.csv'
+
+    def run(self, source_path, reject_path=None):
+        """Отчет об отклоненных строках по умолчанию - рядом с исходным файлом; создается, только если они есть"""
+        reject_path = reject_path or self.reject_path_for(source_path)
+        started = time.perf_counter()
+        processed = imported = rejected = 0
+        report = writer = None
+        with open(source_path, newline='', encoding='utf-8-sig') as source:
+            sample = source.read(4096)
+            source.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.DictReader(source, dialect=dialect)
+            missing = [column for column in self.columns if column not in (reader.fieldnames or ())]
+            if missing:
+                raise ValueError(f"В файле нет столбцов: {', '.join(missing)}")
+
+            def reject(line, record, error):
+                nonlocal rejected, report, writer
+                rejected += 1
+                if writer is None:
+                    report = open(reject_path, 'w', newline='', encoding='utf-8')
+                    writer = csv.writer(report)
+                    writer.writerow(('line', 'error') + self.columns)
+                writer.writerow((line, error) + tuple(record.get(column) for column in self.columns))
+
+            try:
+                batch = []
+                for record in reader:
+                    processed += 1
+                    try:
+                        batch.append((reader.line_num, record, self._validate(record)))
+                    except ValueError as e:
+                        reject(reader.line_num, record, str(e))
+                    if len(batch) >= self.batch_size:
+                        JobCancelled.check(self.cancel)
+                        imported += self._insert(batch, reject)
+                        batch = []
+                        self._report(processed, imported, rejected, started)
+                if batch:
+                    JobCancelled.check(self.cancel)
+                    imported += self._insert(batch, reject)
+            finally:
+                if report is not None:
+                    report.close()
+        stats = ImportStats(processed, imported, rejected, time.perf_counter() - started)
+        if self.progress is not None:
+            self.progress(stats)
+        if imported:
+            (CLIENTS_CACHE if self.table == 'clients' else PRODUCTS_CACHE).clear()
+            Database.notify(self.table)
+        return stats
+
+    def _report(self, processed, imported, rejected, started):
+        if self.progress is not None:
+            self.progress(ImportStats(processed, imported, rejected, time.perf_counter() - started))
+
+
+# --- Потоковая выгрузка заказов ---
+ExportStats = collections.namedtuple('ExportStats', 'rows seconds')
+
+class OrderExporter:
+    """Выгрузка позиций заказов в CSV или Parquet порциями по chunk_size: память не зависит от объема истории"""
+
+    COLUMNS = ('order_id', 'client_id', 'client_fio', 'product_id', 'product_name', 'unit',
+               'quantity', 'price', 'line_total', 'order_total')
+    # Заказы идут по первичному ключу, позиции - по индексу order_id: сортировки в памяти нет
+    QUERY = '''
+        SELECT o.id, o.client_id, c.fio, oi.product_id, p.name, p.unit,
+               oi.quantity, oi.price, oi.quantity * oi.price, {total}
+        FROM {schema}.orders o
+        JOIN {schema}.order_items oi ON oi.order_id = o.id
+        LEFT JOIN main.clients c ON c.id = o.client_id
+        LEFT JOIN main.products p ON p.id = oi.product_id
+        {totals}
+        {where}
+        ORDER BY o.id
+    '''
+    # Итог рабочего заказа - в order_totals, архивного - в самой строке архива
+    SOURCES = {'main': ('t.total', "LEFT JOIN main.order_totals t ON t.order_id = o.id"), 'archive': ('o.total', '')}
+    FORMATS = ('csv', 'parquet')
+
+    def __init__(self, client_id=None, min_id=None, max_id=None, chunk_size=5000, progress=None,
+                 include_archive=False, cancel=None):
+        self.client_id = client_id
+        self.min_id = min_id        # границы id заказов, включительно
+        self.max_id = max_id
+        self.chunk_size = chunk_size
+        self.progress = progress    # progress(ExportStats) после каждой порции
+        self.include_archive = include_archive
+        self.cancel = cancel        # threading.Event: проверяется перед каждой порцией
+
+    def _where(self):
+        conditions, params = [], []
+        for condition, value in (("o.client_id = ?", self.client_id), ("o.id >= ?", self.min_id),
+                                 ("o.id <= ?", self.max_id)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+    def query(self, schema='main'):
+        where, params = self._where()
+        total, totals = self.SOURCES[schema]
+        return self.QUERY.format(schema=schema, total=total, totals=totals, where=where), params
+
+    def chunks(self):
+        """Порции строк из курсора; сначала архивные заказы, если они запрошены, затем рабочие"""
+        with Database.history() if self.include_archive else Database.reader() as conn:
+            attached = [row[1] for row in conn.execute("PRAGMA database_list")]
+            for schema in [schema for schema in ('archive', 'main') if schema in attached]:
+                query, params = self.query(schema)
+                started, rows = time.perf_counter(), 0
+                cursor = conn.execute(query, params)
+                try:
+                    while True:
+                        JobCancelled.check(self.cancel)
+                        chunk = cursor.fetchmany(self.chunk_size)
+                        if not chunk:
+                            break
+                        rows += len(chunk)
+                        yield chunk
+                finally:
+                    cursor.close()
+                    QUERY_STATS.record(conn, query, params, time.perf_counter() - started, rows)
+
+    def run(self, path, fmt=None):
+        fmt = fmt or ('parquet' if path.lower().endswith('.parquet') else 'csv')
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Формат выгрузки {fmt} не поддерживается")
+        started = time.perf_counter()
+        try:
+            rows = self._write_parquet(path, started) if fmt == 'parquet' else self._write_csv(path, started)
+        except JobCancelled:
+            # Недописанный файл не выдаем за выгрузку
+            os.remove(path)
+            raise
+        stats = ExportStats(rows, time.perf_counter() - started)
+        if self.progress is not None:
+            self.progress(stats)
+        return stats
+
+    def _write_csv(self, path, started):
+        rows = 0
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.COLUMNS)
+            for chunk in self.chunks():
+                writer.writerows(chunk)
+                rows += len(chunk)
+                self._report(rows, started)
+        return rows
+
+    def _write_parquet(self, path, started):
+        # pyarrow нужен только для этого формата и загружается при первой выгрузке
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Для выгрузки в Parquet нужен пакет pyarrow")
+        integer, text, real = pyarrow.int64(), pyarrow.string(), pyarrow.float64()
+        schema = pyarrow.schema(list(zip(self.COLUMNS, (integer, integer, text, integer, text, text,
+                                                        integer, real, real, real))))
+        rows = 0
+        # Каждая порция записывается отдельной группой строк
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for chunk in self.chunks():
+                arrays = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                rows += len(chunk)
+                self._report(rows, started)
+        return rows
+
+    def _report(self, rows, started):
+        if self.progress is not None:
+            self.progress(ExportStats(rows, time.perf_counter() - started))
+
+
+# --- Архивация старых заказов ---
+ArchiveStats = collections.namedtuple('ArchiveStats', 'orders seconds')
+
+class OrderArchiver:
+    """Перенос заказов старше даты отсечения в архивный файл порциями; итоги за всю историю не меняются"""
+
+    def __init__(self, before, batch_size=1000, progress=None, vacuum=True):
+        try:
+            self.before = datetime.date.fromisoformat(before).isoformat()
+        except ValueError:
+            raise ValueError("Дата должна быть в формате ГГГГ-ММ-ДД")
+        self.batch_size = batch_size
+        self.progress = progress    # progress(ArchiveStats) после каждой порции
+        self.vacuum = vacuum
+
+    def run(self):
+        started = time.perf_counter()
+        moved = 0
+        with Database.writer() as conn:
+            Database.attach_history(conn, create=True)
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+            try:
+                while True:
+                    count = self._move_batch()
+                    if not count:
+                        break
+                    moved += count
+                    if self.progress is not None:
+                        self.progress(ArchiveStats(moved, time.perf_counter() - started))
+            finally:
+                conn.execute("DROP TABLE IF EXISTS temp.archive_batch")
+                Database.detach_history(conn, True)
+            if moved and self.vacuum:
+                # Освободившиеся страницы возвращаются системе, WAL усекается
+                conn.execute("VACUUM main")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if moved:
+            Database.notify('orders')
+        return ArchiveStats(moved, time.perf_counter() - started)
+
+    def _move_batch(self):
+        # Копия и удаление - разные транзакции: копирование повторяемо, поэтому сбой между ними заказы не теряет
+        with Database.transaction() as cursor:
+            cursor.execute("DELETE FROM temp.archive_batch")
+            cursor.execute('''INSERT INTO temp.archive_batch (id)
+                              SELECT id FROM main.orders WHERE created_at < ? ORDER BY created_at LIMIT ?''',
+                           (self.before, self.batch_size))
+            count = cursor.rowcount
+            if not count:
+                return 0
+            cursor.execute('''
+                INSERT INTO archive.order_items (order_id, product_id, quantity, price)
+                SELECT order_id, product_id, quantity, price FROM main.order_items
+                WHERE order_id IN (SELECT id FROM temp.archive_batch)
+                  AND order_id NOT IN (SELECT id FROM archive.orders)
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO archive.orders (id, client_id, created_at, total)
+                SELECT o.id, o.client_id, o.created_at, COALESCE(t.total, 0)
+                FROM main.orders o LEFT JOIN main.order_totals t ON t.order_id = o.id
+                WHERE o.id IN (SELECT id FROM temp.archive_batch)
+            ''')
+        with Database.transaction() as cursor:
+            cursor.execute("UPDATE archive_state SET active = 1")
+            cursor.execute("DELETE FROM main.order_items WHERE order_id IN (SELECT id FROM temp.archive_batch)")
+            cursor.execute("DELETE FROM main.order_totals WHERE order_id IN (SELECT id FROM temp.archive_batch)")
+            cursor.execute("DELETE FROM main.orders WHERE id IN (SELECT id FROM temp.archive_batch)")
+            cursor.execute("UPDATE archive_state SET active = 0")
+        return count
+
+
+# --- Фоновое выполнение запросов ---
+class DbWorker:
+    """Пул потоков для работы с базой; результаты возвращаются в поток Tk через root.after"""
+
+    def __init__(self, root, max_workers=2, on_busy=None, poll_ms=30):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        self.results = queue.Queue()
+        self.latest = {}    # ключ -> метка последнего запроса; результаты устаревших отбрасываются
+        self.futures = {}
+        self.running = set()    # все незавершенные задачи, чтобы shutdown мог снять очередь
+        self.stopping = threading.Event()   # флаг отмены для длинных задач (импорт, выгрузка)
+        self.pending = 0
+        self.on_busy = on_busy
+        self.poll_ms = poll_ms
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, func, on_done=None, on_error=None, key=None):
+        ticket = object()
+        if key is not None:
+            previous = self.futures.get(key)
+            if previous is not None and previous.cancel():
+                self.pending -= 1
+            self.latest[key] = ticket
+        self.pending += 1
+        future = self.executor.submit(self._run, func, key, ticket, on_done, on_error)
+        self.running.add(future)
+        future.add_done_callback(self.running.discard)
+        if key is not None:
+            self.futures[key] = future
+        self._busy()
+        return future
+
+    def _run(self, func, key, ticket, on_done, on_error):
+        try:
+            # Для диагностики: сколько запросов и времени ушло на одно действие интерфейса
+            with QUERY_STATS.action(str(key) if key is not None else getattr(func, '__qualname__', 'job')):
+                result, error = func(), None
+        except Exception as e:
+            result, error = None, e
+        self.results.put(lambda: self._deliver(key, ticket, on_done, on_error, result, error))
+
+    def _deliver(self, key, ticket, on_done, on_error, result, error):
+        self.pending -= 1
+        if key is not None:
+            if self.latest.get(key) is not ticket:
+                return
+            del self.latest[key]
+            self.futures.pop(key, None)
+        if error is not None:
+            (on_error or self.show_error)(error)
+        elif on_done is not None:
+            on_done(result)
+
+    @staticmethod
+    def show_error(error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+    def in_ui(self, callback):
+        """Обертка, переносящая вызов callback в поток Tk"""
+        def wrapper(*args):
+            if threading.current_thread() is threading.main_thread():
+                callback(*args)
+            else:
+                self.results.put(lambda: callback(*args))
+        return wrapper
+
+    def _poll(self):
+        try:
+            while True:
+                self.results.get_nowait()()
+        except queue.Empty:
+            pass
+        self._busy()
+        self.root.after(self.poll_ms, self._poll)
+
+    def _busy(self):
+        if self.on_busy is not None:
+            self.on_busy(self.pending > 0)
+
+    def shutdown(self):
+        """Не ждет работающие задачи: очередь снимается, длинные задачи прерываются на границе порции"""
+        self.stopping.set()
+        for future in list(self.running):
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
+# --- Постраничная загрузка по ключу (keyset pagination) ---
+class KeysetPager:
+    """Кэш страниц запроса: грузит только нужные страницы и вытесняет далекие от окна"""
+
+    def __init__(self, table, columns, key=('id',), where='', params=(), page_size=100, keep_pages=4):
+        self.table = table          # FROM-часть запроса
+        self.columns = columns      # отображаемые столбцы
+        self.key = key              # столбцы ключа сортировки, последний - уникальный id
+        self.where = where
+        self.params = tuple(params)
+        self.descending = False
+        self.page_size = page_size
+        self.keep_pages = keep_pages
+        self.prefetch = page_size // 2
+        self.pages = {}
+        self.total = None
+        # Пейджер читают фоновые потоки: операции над ним выполняются под этой блокировкой
+        self.lock = threading.RLock()
+
+    def reset(self):
+        self.pages.clear()
+        self.total = None
+
+    def set_filter(self, where, params=()):
+        self.where = where
+        self.params = tuple(params)
+        self.reset()
+
+    def set_order(self, key, descending=False):
+        self.key = key
+        self.descending = descending
+        self.pages.clear()
+
+    def _where(self, condition=''):
+        clauses = [c for c in (self.where, condition) if c]
+        return f" WHERE {' AND '.join(f'({c})' for c in clauses)}" if clauses else ''
+
+    def count(self):
+        if self.total is None:
+            self.total = Database.fetch_all(f"SELECT COUNT(*) FROM {self.table}{self._where()}", self.params)[0][0]
+        return self.total
+
+    def _select(self, condition, params, descending, offset=0):
+        direction = 'DESC' if descending else 'ASC'
+        query = (f"SELECT {', '.join(self.key)}, {', '.join(self.columns)} FROM {self.table}"
+                 f"{self._where(condition)} ORDER BY {', '.join(f'{k} {direction}' for k in self.key)}"
+                 f" LIMIT ? OFFSET ?")
+        rows = Database.fetch_all(query, self.params + tuple(params) + (self.page_size, offset))
+        width = len(self.key)
+        return [(row[:width], row[width:]) for row in rows]
+
+    def _fetch_page(self, number):
+        key = f"({', '.join(self.key)})"
+        marks = f"({', '.join('?' * len(self.key))})"
+        before, after = self.pages.get(number - 1), self.pages.get(number + 1)
+        if before:
+            # Продолжаем от последнего ключа соседней страницы - индексный поиск без OFFSET
+            op = '<' if self.descending else '>'
+            rows = self._select(f"{key} {op} {marks}", before[-1][0], self.descending)
+        elif after:
+            op = '>' if self.descending else '<'
+            rows = self._select(f"{key} {op} {marks}", after[0][0], not self.descending)
+            rows.reverse()
+        else:
+            # Прыжок полосой прокрутки: единственный случай, когда нужен OFFSET
+            rows = self._select('', (), self.descending, number * self.page_size)
+        self.pages[number] = rows
+        return rows
+
+    def _sort_key(self, key):
+        # NULL в SQLite меньше любого значения
+        return tuple((value is not None, value) for value in key)
+
+    def _precedes(self, key, other):
+        key, other = self._sort_key(key), self._sort_key(other)
+        return key > other if self.descending else key < other
+
+    def fetch_row(self, row_id):
+        rows = self._select(f"{self.key[-1]} = ?", (row_id,), self.descending)
+        return rows[0] if rows else None
+
+    def insert(self, row_id):
+        """Учесть вставленную строку: дописать ее в кэш или сбросить только сдвинутые страницы"""
+        row = self.fetch_row(row_id)
+        if row is None:
+            return None
+        if self.total is not None:
+            self.total += 1
+        for number, page in list(self.pages.items()):
+            if not page or self._precedes(page[-1][0], row[0]):
+                # Страница целиком раньше новой строки; неполная последняя страница принимает ее в конец
+                if len(page) < self.page_size:
+                    page.append(row)
+            else:
+                del self.pages[number]
+        return row
+
+    def rows(self, start, count):
+        """Строки [start, start + count) как пары (ключ, значения)"""
+        total = self.count()
+        end = min(start + count, total)
+        if start >= end:
+            return []
+        first = max(0, start - self.prefetch) // self.page_size
+        last = (min(total, end + self.prefetch) - 1) // self.page_size
+        window = []
+        for number in range(first, last + 1):
+            page = self.pages.get(number)
+            window.extend(page if page is not None else self._fetch_page(number))
+        for number in [n for n in self.pages if n < first - self.keep_pages or n > last + self.keep_pages]:
+            del self.pages[number]
+        offset = first * self.page_size
+        return window[start - offset:end - offset]
+
+
+class VirtualTree(ttk.Frame):
+    """Treeview, в котором существуют только видимые строки; данные поставляет KeysetPager"""
+
+    def __init__(self, master, columns, pager, formatter=None, worker=None, on_error=None):
+        super().__init__(master)
+        self.pager = pager
+        self.formatter = formatter
+        self.worker = worker
+        self.on_error = on_error
+        self.top = 0
+        self.total = 0
+        self.visible = 20
+        # Изменения пейджера, которые применит ближайшая фоновая подгрузка
+        self._ops = collections.deque()
+        self.tree = ttk.Treeview(self, columns=columns, show='headings')
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self._on_scrollbar)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        self.tree.bind('<Button-4>', lambda e: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda e: self.scroll(3))
+        self.tree.bind('<Prior>', lambda e: self.scroll(-self.visible))
+        self.tree.bind('<Next>', lambda e: self.scroll(self.visible))
+
+    def heading(self, column, **kw):
+        return self.tree.heading(column, **kw)
+
+    def refresh(self):
+        self._request(self.pager.reset)
+
+    def insert_row(self, row_id):
+        self._request(lambda: self.pager.insert(row_id))
+
+    def sort(self, key, descending=False):
+        self.top = 0
+        self._request(lambda: self.pager.set_order(key, descending))
+
+    def filter(self, where, params=()):
+        self.top = 0
+        self._request(lambda: self.pager.set_filter(where, params))
+
+    def scroll(self, delta):
+        self.scroll_to(self.top + delta)
+
+    def scroll_to(self, top):
+        self.top = max(0, min(top, self.total - self.visible))
+        self._request()
+
+    def _request(self, op=None):
+        if op is not None:
+            self._ops.append(op)
+        top, visible = self.top, self.visible
+        if self.worker is None:
+            self._show(self._load(top, visible))
+        else:
+            # Новая подгрузка вытесняет еще не начатую; накопленные операции выполнит последняя
+            self.worker.submit(lambda: self._load(top, visible), self._show, self.on_error, key=self)
+
+    def _load(self, top, visible):
+        with self.pager.lock:
+            while self._ops:
+                self._ops.popleft()()
+            total = self.pager.count()
+            top = max(0, min(top, total - visible))
+            return top, total, self.pager.rows(top, visible)
+
+    def _show(self, result):
+        self.top, self.total, rows = result
+        selection = self.tree.selection()
+        self.tree.delete(*self.tree.get_children())
+        for key, values in rows:
+            self.tree.insert('', 'end', iid=str(key[-1]), values=self.formatter(values) if self.formatter else values)
+        self.tree.selection_set([iid for iid in selection if self.tree.exists(iid)])
+        if self.total:
+            self.scrollbar.set(self.top / self.total, (self.top + len(rows)) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_scrollbar(self, action, *args):
+        if action == 'moveto':
+            self.scroll_to(int(float(args[0]) * self.total))
+        elif action == 'scroll':
+            step = self.visible if args[1] == 'pages' else 1
+            self.scroll(int(args[0]) * step)
+
+    def _on_resize(self, event):
+        row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        # Одна строка уходит под заголовки столбцов
+        visible = max(1, event.height // row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.scroll_to(self.top)
+
+
+class BarChart:
+    """Столбчатая диаграмма на оси встроенной фигуры: новые данные меняют высоты и подписи, а не всю фигуру"""
+
+    def __init__(self, ax, title, ylabel, color=None, max_labels=None):
+        self.ax = ax
+        self.color = color
+        self.max_labels = max_labels    # при большем числе столбцов подписывается только каждый n-й
+        self.bars = None
+        self.data = None
+        ax.set_title(title)
+        ax.set_ylabel(ylabel)
+
+    def update(self, labels, values):
+        """True, если изображение изменилось и холст нужно перерисовать"""
+        data = (tuple(labels), tuple(values))
+        if data == self.data:
+            return False
+        self.data = data
+        if self.bars is None or len(self.bars) != len(values):
+            # Изменилось число столбцов - пересоздаем только их
+            if self.bars is not None:
+                self.bars.remove()
+            self.bars = self.ax.bar(range(len(values)), values, color=self.color)
+            self.ax.set_xticks(range(len(values)))
+        else:
+            for bar, value in zip(self.bars, values):
+                bar.set_height(value)
+        if self.max_labels and len(labels) > self.max_labels:
+            step = -(-len(labels) // self.max_labels)
+            labels = [label if index % step == 0 else '' for index, label in enumerate(labels)]
+        self.ax.set_xticklabels(labels, rotation=45, ha='right')
+        self.ax.set_ylim(0, max(values, default=0) * 1.1 or 1)
+        return True
+
 
 # --- Главное окно ---
 class App:
@@ -140,18 +1879,209 @@ class App:
             self.root = root
             self.root.title("Интернет-магазин")
             self.notebook = ttk.Notebook(root)
+            self.init_status_bar()
             self.notebook.pack(fill='both', expand=True)
+
+            # Все запросы к базе идут в фоновых потоках, mainloop не ждет ввода-вывода
+            self.worker = DbWorker(root, on_busy=self.set_busy)
+            self.root.protocol('WM_DELETE_WINDOW', self.close)
             
             # Переменная для отслеживания порядка сортировки
             self.sort_direction = {}
+            # Отложенные вызовы поиска по мере ввода
+            self.pending_searches = {}
+            # id строк, показанных в combo_clients и list_products, в том же порядке
+            self.client_choices = []
+            self.product_choices = []
 
             self.init_clients_tab()
             self.init_products_tab()
             self.init_orders_tab()
             self.init_statistics_tab()
+            self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+
+            # Вставки обновляют только затронутые строки; полная перезагрузка - по F5
+            Database.subscribe('clients', self.worker.in_ui(self.on_client_saved))
+            Database.subscribe('products', self.worker.in_ui(self.on_product_saved))
+            Database.subscribe('orders', self.worker.in_ui(self.on_order_saved))
+            self.root.bind('<F5>', lambda event: self.reload_current_tab())
+            self.root.bind('<F12>', lambda event: self.show_diagnostics())
         except Exception as e:
             messagebox.showerror("Ошибка инициализации", f"Ошибка при создании интерфейса: {e}")
 
+    def init_status_bar(self):
+        self.status_bar = ttk.Frame(self.root)
+        self.status_bar.pack(side='bottom', fill='x')
+        self.busy_label = ttk.Label(self.status_bar, text="")
+        self.busy_label.pack(side='left', padx=5)
+        self.busy_bar = ttk.Progressbar(self.status_bar, mode='indeterminate', length=120)
+        self.busy_bar.pack(side='right', padx=5, pady=2)
+        self.busy = False
+
+    def set_busy(self, busy):
+        if busy == self.busy:
+            return
+        self.busy = busy
+        if busy:
+            self.busy_label['text'] = "Загрузка..."
+            self.busy_bar.start(15)
+        else:
+            self.busy_label['text'] = ""
+            self.busy_bar.stop()
+
+    def report_error(self, message):
+        """Обработчик ошибок фоновой задачи в стиле остальных окон приложения"""
+        def handler(e):
+            if isinstance(e, ValueError):
+                messagebox.showerror("Ошибка", str(e))
+            else:
+                messagebox.showerror("Ошибка базы данных", f"{message}: {e}")
+        return handler
+
+    def import_csv(self, table):
+        source_path = filedialog.askopenfilename(filetypes=[("CSV", "*.csv"), ("Все файлы", "*.*")])
+        if not source_path:
+            return
+        reject_path = CsvImporter.reject_path_for(source_path)
+        importer = CsvImporter(table, progress=self.worker.in_ui(self.show_import_progress),
+                               cancel=self.worker.stopping)
+        self.worker.submit(lambda: importer.run(source_path, reject_path),
+                           lambda stats: self.show_import_result(stats, reject_path),
+                           self.report_error("Ошибка при импорте"))
+
+    def show_import_progress(self, stats):
+        rate = stats.processed / stats.seconds if stats.seconds else 0
+        self.busy_label['text'] = f"Импорт: {stats.processed} строк, {rate:.0f} строк/с"
+
+    def show_import_result(self, stats, reject_path):
+        message = (f"Обработано строк: {stats.processed}\nЗагружено: {stats.imported}\n"
+                   f"Отклонено: {stats.rejected}\nВремя: {stats.seconds:.1f} с")
+        if stats.rejected:
+            message += f"\nОтчет об отклоненных строках: {reject_path}"
+        messagebox.showinfo("Импорт завершен", message)
+
+    def export_orders(self):
+        path = filedialog.asksaveasfilename(defaultextension='.csv',
+                                            filetypes=[("CSV", "*.csv"), ("Parquet", "*.parquet")])
+        if not path:
+            return
+        client_id = None
+        client_index = self.combo_clients.current()
+        if client_index >= 0 and messagebox.askyesno(
+                "Выгрузка заказов", f"Выгрузить только заказы клиента {self.combo_clients.get()}?"):
+            client_id = self.client_choices[client_index]
+        # Диапазон номеров заказов необязателен: "Отмена" оставляет границу открытой
+        min_id = simpledialog.askinteger("Выгрузка заказов", "С заказа №\n(Отмена - с первого)",
+                                         parent=self.root, minvalue=1)
+        max_id = simpledialog.askinteger("Выгрузка заказов", "По заказ №\n(Отмена - до последнего)",
+                                         parent=self.root, minvalue=min_id or 1)
+        # Выгрузка для учета - полная история, вместе с архивом
+        exporter = OrderExporter(client_id, min_id, max_id, progress=self.worker.in_ui(self.show_export_progress),
+                                 include_archive=True, cancel=self.worker.stopping)
+        self.worker.submit(lambda: exporter.run(path), lambda stats: messagebox.showinfo(
+            "Выгрузка завершена", f"Выгружено строк: {stats.rows}\nВремя: {stats.seconds:.1f} с\nФайл: {path}"
+        ), self.report_error("Ошибка при выгрузке заказов"))
+
+    def show_export_progress(self, stats):
+        rate = stats.rows / stats.seconds if stats.seconds else 0
+        self.busy_label['text'] = f"Выгрузка: {stats.rows} строк, {rate:.0f} строк/с"
+
+    def debounce(self, name, func, delay_ms=250):
+        """Вызвать func, когда ввод затихнет на delay_ms"""
+        after_id = self.pending_searches.pop(name, None)
+        if after_id is not None:
+            self.root.after_cancel(after_id)
+
+        def fire():
+            self.pending_searches.pop(name, None)
+            func()
+        self.pending_searches[name] = self.root.after(delay_ms, fire)
+
+    def close(self):
+        self.worker.shutdown()
+        self.root.destroy()
+
+    def reload_current_tab(self):
+        tab = self.notebook.index('current')
+        if tab == 0:
+            self.load_clients()
+        elif tab == 1:
+            self.load_products()
+        elif tab == 2:
+            self.load_clients_for_order()
+            self.load_products_for_order()
+            self.load_orders()
+
+    def show_diagnostics(self):
+        """Окно с самыми затратными запросами, последними действиями и журналом медленных запросов"""
+        window = tk.Toplevel(self.root)
+        window.title("Диагностика запросов")
+        columns = ('Calls', 'Rows', 'Total', 'Avg', 'Max', 'P95')
+        tree = ttk.Treeview(window, columns=columns, height=12)
+        tree.heading('#0', text='Запрос')
+        tree.column('#0', width=480)
+        for column, title in zip(columns, ("Вызовов", "Строк", "Всего, мс", "Среднее, мс", "Максимум, мс", "p95, мс")):
+            tree.heading(column, text=title)
+            tree.column(column, width=80, anchor='e')
+        tree.pack(fill='both', expand=True, padx=5, pady=5)
+        log = tk.Text(window, height=12, wrap='none')
+        log.pack(fill='both', expand=True, padx=5, pady=5)
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            for query, *values in QUERY_STATS.top(50):
+                tree.insert('', 'end', text=query, values=values)
+            log.delete('1.0', 'end')
+            for name, count, ms in reversed(QUERY_STATS.actions):
+                log.insert('end', f"{name}: запросов {count}, {ms} мс\n")
+            for when, ms, query, plan in reversed(QUERY_STATS.slow):
+                log.insert('end', f"{when} медленный запрос {ms} мс: {query}\n" + ''.join(f"    {line}\n" for line in plan))
+
+        def reset():
+            QUERY_STATS.reset()
+            refresh()
+
+        buttons = ttk.Frame(window)
+        buttons.pack(fill='x', padx=5, pady=5)
+        ttk.Button(buttons, text="Обновить", command=refresh).pack(side='left')
+        ttk.Button(buttons, text="Сбросить", command=reset).pack(side='left', padx=5)
+        refresh()
+
+    def on_client_saved(self, client_id):
+        if client_id is None:
+            self.load_clients()
+            self.load_clients_for_order()
+            return
+        self.tree_clients.insert_row(client_id)
+        # Таблица может быть отфильтрована поиском; форма заказа берет новую строку из справочника напрямую
+        self.worker.submit(lambda: CLIENTS_CACHE.get(client_id), lambda row: self.append_client_choice(client_id, row),
+                           self.report_error("Ошибка при загрузке клиентов"))
+
+    def append_client_choice(self, client_id, row):
+        if row is not None:
+            self.client_choices.append(client_id)
+            self.combo_clients['values'] = tuple(self.combo_clients['values']) + (self.client_label(row),)
+
+    def on_product_saved(self, product_id):
+        if product_id is None:
+            self.load_products()
+            self.load_products_for_order()
+            return
+        self.tree_products.insert_row(product_id)
+        self.worker.submit(lambda: PRODUCTS_CACHE.get(product_id), lambda row: self.append_product_choice(product_id, row),
+                           self.report_error("Ошибка при загрузке товаров"))
+
+    def append_product_choice(self, product_id, row):
+        if row is not None:
+            self.product_choices.append(product_id)
+            self.list_products.insert(tk.END, self.product_label(row))
+
+    def on_order_saved(self, order_id):
+        if order_id is None:
+            self.load_orders()
+        else:
+            self.tree_orders.insert_row(order_id)
+
     # --- Вкладка "Клиенты" ---
     def init_clients_tab(self):
         self.clients_frame = ttk.Frame(self.notebook)
@@ -170,22 +2100,23 @@ class App:
         ttk.Label(input_frame, text="Адрес:").grid(row=1, column=2)
         self.entry_address = ttk.Entry(input_frame)
         self.entry_address.grid(row=1, column=3)
-        ttk.Button(input_frame, text="Добавить клиента", command=self.add_client).grid(row=2, column=0, columnspan=4, pady=5)
-        self.tree_clients = ttk.Treeview(self.clients_frame, columns=('FIO', 'Phone', 'Email', 'Address'), show='headings')
+        ttk.Button(input_frame, text="Добавить клиента", command=self.add_client).grid(row=2, column=0, columnspan=2, pady=5)
+        ttk.Button(input_frame, text="Импорт из CSV", command=lambda: self.import_csv('clients')).grid(row=2, column=2, columnspan=2, pady=5)
+        ttk.Label(input_frame, text="Поиск:").grid(row=3, column=0)
+        self.entry_client_search = ttk.Entry(input_frame)
+        self.entry_client_search.grid(row=3, column=1, columnspan=3, sticky='we')
+        self.entry_client_search.bind('<KeyRelease>', lambda e: self.debounce(
+            'clients', lambda: self.tree_clients.filter(*Search.filter('clients', self.entry_client_search.get()))))
+        self.tree_clients = VirtualTree(self.clients_frame, ('FIO', 'Phone', 'Email', 'Address'),
+                                        KeysetPager('clients', ('fio', 'phone', 'email', 'address')),
+                                        worker=self.worker, on_error=self.report_error("Ошибка при загрузке клиентов"))
         for col in ('FIO', 'Phone', 'Email', 'Address'):
             self.tree_clients.heading(col, text=col)
         self.tree_clients.pack(padx=10, pady=10, fill='both', expand=True)
         self.load_clients()
 
     def load_clients(self):
-        try:
-            for row in self.tree_clients.get_children():
-                self.tree_clients.delete(row)
-            rows = Database.fetch_all("SELECT fio, phone, email, address FROM clients")
-            for row in rows:
-                self.tree_clients.insert('', 'end', values=row)
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при загрузке клиентов: {e}")
+        self.tree_clients.refresh()
 
     def add_client(self):
         fio = self.entry_fio.get().strip()
@@ -195,17 +2126,19 @@ class App:
         
         try:
             client = Client(fio, phone, email, address)
-            client.save()
-            self.load_clients()
-            # Очищаем поля после добавления
-            self.entry_fio.delete(0, tk.END)
-            self.entry_phone.delete(0, tk.END)
-            self.entry_email.delete(0, tk.END)
-            self.entry_address.delete(0, tk.END)
+            client.validate()
         except ValueError as e:
             messagebox.showerror("Ошибка", str(e))
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при добавлении клиента: {e}")
+            return
+        self.worker.submit(client.save, lambda client_id: self.clear_client_form(),
+                           self.report_error("Ошибка при добавлении клиента"))
+
+    def clear_client_form(self):
+        # Очищаем поля после добавления
+        self.entry_fio.delete(0, tk.END)
+        self.entry_phone.delete(0, tk.END)
+        self.entry_email.delete(0, tk.END)
+        self.entry_address.delete(0, tk.END)
 
     # --- Вкладка "Товары" ---
     def init_products_tab(self):
@@ -228,10 +2161,18 @@ class App:
         self.entry_product_price = ttk.Entry(input_frame)
         self.entry_product_price.grid(row=2, column=1)
         # Кнопка
-        ttk.Button(input_frame, text="Добавить товар", command=self.add_product).grid(row=3, column=0, columnspan=2, pady=5)
+        ttk.Button(input_frame, text="Добавить товар", command=self.add_product).grid(row=3, column=0, pady=5)
+        ttk.Button(input_frame, text="Импорт из CSV", command=lambda: self.import_csv('products')).grid(row=3, column=1, pady=5)
+        ttk.Label(input_frame, text="Поиск:").grid(row=4, column=0, sticky='w')
+        self.entry_product_search = ttk.Entry(input_frame)
+        self.entry_product_search.grid(row=4, column=1)
+        self.entry_product_search.bind('<KeyRelease>', lambda e: self.debounce(
+            'products', lambda: self.tree_products.filter(*Search.filter('products', self.entry_product_search.get()))))
 
         # Таблица товаров
-        self.tree_products = ttk.Treeview(self.products_frame, columns=('Name', 'Price', 'Unit'), show='headings')
+        self.tree_products = VirtualTree(self.products_frame, ('Name', 'Price', 'Unit'),
+                                         KeysetPager('products', ('name', 'price', 'unit')),
+                                         worker=self.worker, on_error=self.report_error("Ошибка при загрузке товаров"))
         self.tree_products.heading('Name', text='Наименование')
         self.tree_products.heading('Price', text='Стоимость')
         self.tree_products.heading('Unit', text='Ед.изм.')
@@ -239,14 +2180,7 @@ class App:
         self.load_products()
 
     def load_products(self):
-        try:
-            for row in self.tree_products.get_children():
-                self.tree_products.delete(row)
-            rows = Database.fetch_all("SELECT name, price, unit FROM products")
-            for row in rows:
-                self.tree_products.insert('', 'end', values=row)
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при загрузке товаров: {e}")
+        self.tree_products.refresh()
 
     def add_product(self):
         name = self.entry_product_name.get().strip()
@@ -256,16 +2190,18 @@ class App:
         try:
             price = float(price_str)
             product = Product(name, price, unit)
-            product.save()
-            # очистить поля
-            self.entry_product_name.delete(0, tk.END)
-            self.entry_unit.delete(0, tk.END)
-            self.entry_product_price.delete(0, tk.END)
-            self.load_products()
+            product.validate()
         except ValueError as e:
             messagebox.showerror("Ошибка", str(e))
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при добавлении товара: {e}")
+            return
+        self.worker.submit(product.save, lambda product_id: self.clear_product_form(),
+                           self.report_error("Ошибка при добавлении товара"))
+
+    def clear_product_form(self):
+        # очистить поля
+        self.entry_product_name.delete(0, tk.END)
+        self.entry_unit.delete(0, tk.END)
+        self.entry_product_price.delete(0, tk.END)
 
     # --- Вкладка "Заказы" ---
     def init_orders_tab(self):
@@ -276,28 +2212,40 @@ class App:
 
         # Клиент + Обновление списка
         ttk.Label(frame_order, text="Клиент:").grid(row=0, column=0)
-        self.combo_clients = ttk.Combobox(frame_order, state='readonly', width=30)
+        # Поле ввода с подсказками: по мере набора список заменяется лучшими совпадениями
+        self.combo_clients = ttk.Combobox(frame_order, width=30)
+        self.combo_clients.bind('<KeyRelease>', self.on_client_typed)
         ttk.Button(frame_order, text="Обновить клиентов", command=self.load_clients_for_order).grid(row=0, column=2, padx=5)
         self.combo_clients.grid(row=0, column=1)
 
-        # Товары + Обновление
-        ttk.Label(frame_order, text="Товары:").grid(row=1, column=0, sticky='ne')
+        # Товары + Поиск + Обновление
+        ttk.Label(frame_order, text="Поиск товара:").grid(row=1, column=0, sticky='e')
+        self.entry_order_product_search = ttk.Entry(frame_order, width=30)
+        self.entry_order_product_search.grid(row=1, column=1)
+        self.entry_order_product_search.bind('<KeyRelease>', lambda e: self.debounce('order_products', self.search_products_for_order))
+        ttk.Label(frame_order, text="Товары:").grid(row=2, column=0, sticky='ne')
         self.list_products = tk.Listbox(frame_order, selectmode='multiple', height=6)
-        self.list_products.grid(row=1, column=1)
-        ttk.Button(frame_order, text="Обновить список товаров", command=self.load_products_for_order).grid(row=2, column=1, pady=5)
+        self.list_products.grid(row=2, column=1)
+        ttk.Button(frame_order, text="Обновить список товаров", command=self.load_products_for_order).grid(row=3, column=1, pady=5)
 
         # Количество
-        ttk.Label(frame_order, text="Количество:").grid(row=3, column=0, sticky='e')
+        ttk.Label(frame_order, text="Количество:").grid(row=4, column=0, sticky='e')
         self.entry_qty = ttk.Entry(frame_order, width=5)
-        self.entry_qty.grid(row=3, column=1, sticky='w')
+        self.entry_qty.grid(row=4, column=1, sticky='w')
 
         # Создать заказ
-        ttk.Button(frame_order, text="Создать заказ", command=self.create_order).grid(row=4, column=0, columnspan=3, pady=5)
+        ttk.Button(frame_order, text="Создать заказ", command=self.create_order).grid(row=5, column=0, columnspan=3, pady=5)
+        ttk.Button(frame_order, text="Выгрузить заказы...", command=self.export_orders).grid(row=6, column=0, columnspan=3)
 
         # Таблица заказов
-        self.tree_orders = ttk.Treeview(self.orders_frame, columns=('Client', 'Items', 'Total'), show='headings')
-        self.tree_orders.heading('Client', text='Клиент')
-        self.tree_orders.heading('Items', text='Товары (кол-во)')
+        # Состав и сумма заказа берутся из сводной таблицы order_totals, которую ведут триггеры
+        self.tree_orders = VirtualTree(self.orders_frame, ('Client', 'Items', 'Total'), KeysetPager(
+            'order_totals t',
+            ('t.client_fio', 't.items', 't.total'),
+            key=('t.order_id',)
+        ), formatter=self.format_order_row, worker=self.worker, on_error=self.report_error("Ошибка при загрузке заказов"))
+        self.tree_orders.heading('Client', text='Клиент', command=lambda: self.sort_orders('Client'))
+        self.tree_orders.heading('Items', text='Товары (кол-во)', command=lambda: self.sort_orders('Items'))
         self.tree_orders.heading('Total', text='Общая стоимость', command=lambda: self.sort_orders('Total'))
         self.tree_orders.pack(padx=10, pady=10, fill='both', expand=True)
         
@@ -309,48 +2257,93 @@ class App:
         self.load_products_for_order()
         self.load_orders()
 
+    # Столбец таблицы заказов -> индексированный ключ сортировки в order_totals
+    ORDER_SORT_KEYS = {'Client': 't.client_fio', 'Items': 't.items_count', 'Total': 't.total'}
+
     def sort_orders(self, column):
-        """Сортировка таблицы заказов по выбранному столбцу"""
-        try:           
-            items = [(self.tree_orders.set(item, column), item) for item in self.tree_orders.get_children('')]            
-            
-            if column == 'Total':               
-                items = [(float(item[0].replace(' руб.', '')), item[1]) for item in items]
-            else:                
-                items = [(item[0].lower(), item[1]) for item in items]            
-            
-            items.sort(reverse=self.sort_direction['orders'][column])            
-           
-            for index, (_, item) in enumerate(items):
-                self.tree_orders.move(item, '', index)            
-            
-            self.sort_direction['orders'][column] = not self.sort_direction['orders'][column]
-        except Exception as e:
-            messagebox.showerror("Ошибка сортировки", f"Ошибка при сортировке данных: {e}")
+        """Сортировка таблицы заказов по выбранному столбцу (ORDER BY по индексу в базе)"""
+        descending = self.sort_direction['orders'][column]
+        self.tree_orders.sort((self.ORDER_SORT_KEYS[column], 't.order_id'), descending)
+        self.sort_direction['orders'][column] = not descending
+
+    # Подписи различают однофамильцев и одноименные товары; выбор сопоставляется с id по позиции
+    @staticmethod
+    def client_label(row):
+        fio, phone = row
+        return f"{fio} ({phone})"
+
+    @staticmethod
+    def product_label(row):
+        name, price, unit = row
+        return f"{name} - {price:.2f} руб./{unit}"
 
     def load_clients_for_order(self):
-        try:
-            rows = Database.fetch_all("SELECT fio FROM clients")
-            self.combo_clients['values'] = [row[0] for row in rows]
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при загрузке клиентов: {e}")
+        self.worker.submit(CLIENTS_CACHE.fill, self.show_clients_for_order,
+                           self.report_error("Ошибка при загрузке клиентов"), key='combo_clients')
+
+    def show_clients_for_order(self, rows, drop_down=False):
+        self.client_choices = [row[0] for row in rows]
+        self.combo_clients['values'] = [self.client_label(row[1:]) for row in rows]
+        # Подсказки поиска раскрываем сразу, пока оператор печатает в поле
+        if drop_down and rows and self.combo_clients.focus_get() is self.combo_clients:
+            self.combo_clients.event_generate('<Down>')
 
     def load_products_for_order(self):
-        try:
-            self.list_products.delete(0, tk.END)
-            rows = Database.fetch_all("SELECT name FROM products")
-            for row in rows:
-                self.list_products.insert(tk.END, row[0])
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при загрузке товаров: {e}")
+        self.worker.submit(PRODUCTS_CACHE.fill, self.show_products_for_order,
+                           self.report_error("Ошибка при загрузке товаров"), key='list_products')
+
+    def show_products_for_order(self, rows):
+        # Уже отмеченные товары остаются в списке и отмеченными, чтобы поиск не сбрасывал выбор
+        indexes = self.list_products.curselection()
+        selected = [self.product_choices[idx] for idx in indexes]
+        labels = [self.list_products.get(idx) for idx in indexes]
+        self.product_choices = list(selected)
+        self.list_products.delete(0, tk.END)
+        for label in labels:
+            self.list_products.insert(tk.END, label)
+        if selected:
+            self.list_products.selection_set(0, len(selected) - 1)
+        for row in rows:
+            if row[0] not in selected:
+                self.product_choices.append(row[0])
+                self.list_products.insert(tk.END, self.product_label(row[1:]))
+
+    def on_client_typed(self, event):
+        if event.keysym in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            return
+        self.debounce('order_clients', self.search_clients_for_order)
+
+    def search_clients_for_order(self):
+        text = self.combo_clients.get()
+        if not Search.match_query(text):
+            self.load_clients_for_order()
+            return
+        def search():
+            rows = Search.clients(text)
+            CLIENTS_CACHE.put(rows)
+            return rows
+        self.worker.submit(search, lambda rows: self.show_clients_for_order(rows, drop_down=True),
+                           self.report_error("Ошибка при поиске клиентов"), key='combo_clients')
+
+    def search_products_for_order(self):
+        text = self.entry_order_product_search.get()
+        if not Search.match_query(text):
+            self.load_products_for_order()
+            return
+        def search():
+            rows = Search.products(text)
+            PRODUCTS_CACHE.put(rows)
+            return rows
+        self.worker.submit(search, self.show_products_for_order,
+                           self.report_error("Ошибка при поиске товаров"), key='list_products')
 
     def create_order(self):
-        client_name = self.combo_clients.get()
+        client_index = self.combo_clients.current()
         qty_str = self.entry_qty.get().strip()
         
         try:
-            if not client_name:
-                raise ValueError("Выберите клиента")
+            if client_index < 0:
+                raise ValueError("Выберите клиента из списка")
             if not qty_str:
                 raise ValueError("Введите количество")
             
@@ -361,54 +2354,26 @@ class App:
             selected = self.list_products.curselection()
             if not selected:
                 raise ValueError("Выберите товары")            
-            
-            client_rows = Database.fetch_all("SELECT id FROM clients WHERE fio=?", (client_name,))
-            if not client_rows:
-                raise ValueError("Клиент не найден")
-            client_id = client_rows[0][0]            
-            
-            order = Order()
-            order.client_id = client_id            
-           
-            for idx in selected:
-                product_name = self.list_products.get(idx)
-                product_rows = Database.fetch_all("SELECT id FROM products WHERE name=?", (product_name,))
-                if product_rows:
-                    product_id = product_rows[0][0]
-                    order.add_item(product_id, qty)
-            
-            # Сохраняем заказ
-            order.save()
-            self.load_orders()
-            
         except ValueError as e:
             messagebox.showerror("Ошибка", str(e))
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при создании заказа: {e}")
+            return
+
+        # Клиент и товары уже известны по id - поисковых запросов перед сохранением нет
+        order = Order()
+        order.client_id = self.client_choices[client_index]
+        for idx in selected:
+            order.add_item(self.product_choices[idx], qty)
+        
+        # Сохраняем заказ
+        self.worker.submit(order.save, on_error=self.report_error("Ошибка при создании заказа"))
 
     def load_orders(self):
-        try:
-            for row in self.tree_orders.get_children():
-                self.tree_orders.delete(row)
-            
-            rows = Database.fetch_all('''
-                SELECT 
-                    c.fio, 
-                    GROUP_CONCAT(p.name || ' x' || oi.quantity, ', '),
-                    SUM(oi.quantity * p.price) as total_sum
-                FROM orders o
-                JOIN clients c ON o.client_id=c.id
-                JOIN order_items oi ON o.id=oi.order_id
-                JOIN products p ON oi.product_id=p.id
-                GROUP BY o.id, c.fio
-            ''')
-            
-            for row in rows:
-                total_formatted = f"{row[2]:.2f} руб." if row[2] else "0.00 руб."
-                self.tree_orders.insert('', 'end', values=(row[0], row[1], total_formatted))
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка базы данных", f"Ошибка при загрузке заказов: {e}")
+        self.tree_orders.refresh()
+
+    @staticmethod
+    def format_order_row(values):
+        fio, items, total = values
+        return (fio, items, f"{total:.2f} руб." if total else "0.00 руб.")
 
     # --- Вкладка "Статистика" ---
     def init_statistics_tab(self):
@@ -416,51 +2381,269 @@ class App:
         self.notebook.add(self.stats_frame, text='Статистика и Анализ')
         ttk.Button(self.stats_frame, text="Топ 5 клиентов", command=self.plot_top_clients).pack(pady=10)
         ttk.Button(self.stats_frame, text="География клиентов", command=self.plot_geo_clients).pack(pady=10)
-        self.fig = plt.Figure(figsize=(6,4))
-        self.ax1 = self.fig.add_subplot(121)
-        self.ax2 = self.fig.add_subplot(122)
+        # Выручка за период читается из дневных и месячных сводок
+        frame_period = ttk.Frame(self.stats_frame)
+        frame_period.pack(pady=5)
+        today = datetime.date.today()
+        ttk.Label(frame_period, text="Выручка с:").pack(side='left')
+        self.entry_period_start = ttk.Entry(frame_period, width=12)
+        self.entry_period_start.insert(0, (today - datetime.timedelta(days=30)).isoformat())
+        self.entry_period_start.pack(side='left', padx=5)
+        ttk.Label(frame_period, text="по:").pack(side='left')
+        self.entry_period_end = ttk.Entry(frame_period, width=12)
+        self.entry_period_end.insert(0, today.isoformat())
+        self.entry_period_end.pack(side='left', padx=5)
+        self.combo_period = ttk.Combobox(frame_period, values=list(self.REVENUE_PERIODS), state='readonly', width=8)
+        self.combo_period.current(0)
+        self.combo_period.pack(side='left', padx=5)
+        ttk.Button(frame_period, text="Показать", command=self.plot_revenue).pack(side='left')
+        self.analytics_status = ttk.Label(self.stats_frame, text="")
+        self.analytics_status.pack(pady=5)
+        # Фигура и холст создаются вместе с импортом matplotlib при первом открытии вкладки
+        self.fig = None
         self.canvas = None
 
+    def on_tab_changed(self, event):
+        if self.notebook.select() == str(self.stats_frame):
+            self.init_charts()
+
+    def init_charts(self):
+        if self.fig is not None:
+            return
+        self.busy_label['text'] = "Загрузка модулей аналитики..."
+        self.root.update_idletasks()
+        load_analytics()
+        self.fig = Figure(figsize=(10, 7))
+        self.ax1 = self.fig.add_subplot(221)
+        self.ax2 = self.fig.add_subplot(222)
+        self.ax3 = self.fig.add_subplot(212)
+        self.top_chart = BarChart(self.ax1, 'Топ 5 клиентов по сумме заказов', 'Общая сумма')
+        self.geo_chart = BarChart(self.ax2, 'География клиентов по городам', 'Количество клиентов', color='red')
+        self.revenue_chart = BarChart(self.ax3, 'Выручка за период', 'Выручка', color='green', max_labels=15)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.stats_frame)
+        self.canvas.get_tk_widget().pack(fill='both', expand=True)
+        self.busy_label['text'] = ""
+
+    def render_chart(self, chart, labels, values):
+        # Неизменившиеся данные не перерисовываются: на холсте остается прошлое изображение
+        if chart.update(labels, values):
+            self.fig.tight_layout()
+            self.canvas.draw_idle()
+
     def plot_top_clients(self):
+        self.init_charts()
+
+        self.worker.submit(lambda: ANALYTICS.top_clients(5), self.draw_top_clients,
+                           self.report_error("Ошибка при построении топа клиентов"), key='plot_top')
+
+    def draw_top_clients(self, rows):
+        self.analytics_status['text'] = f"Топ клиентов: {ANALYTICS.summary(('top_clients', 5))}"
         try:
-            df = pd.read_sql_query('''
-                SELECT c.fio, SUM(oi.quantity * p.price) as total
-                FROM orders o
-                JOIN clients c ON o.client_id=c.id
-                JOIN order_items oi ON o.id=oi.order_id
-                JOIN products p ON oi.product_id=p.id
-                GROUP BY c.fio
-                ORDER BY total DESC
-            ''', sqlite3.connect('shop.db'))
-            
-            plt.clf()
-            plt.bar(df['fio'].head(5), df['total'].head(5))
-            plt.title('Топ 5 клиентов по сумме заказов')
-            plt.ylabel('Общая сумма')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.show()
+            self.render_chart(self.top_chart, [row[0] for row in rows], [row[1] for row in rows])
         except Exception as e:
             messagebox.showerror("Ошибка построения графика", f"Ошибка при построении топа клиентов: {e}")
 
+    GEO_CITIES = 10     # столбцов на диаграмме географии
+    REVENUE_PERIODS = {'по дням': 'day', 'по месяцам': 'month'}
+
+    def plot_revenue(self):
+        start, end = self.entry_period_start.get().strip(), self.entry_period_end.get().strip()
+        period = self.REVENUE_PERIODS[self.combo_period.get()]
+        try:
+            Analytics.period_bounds(start, end, period)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+        self.init_charts()
+        self.worker.submit(lambda: Analytics.revenue(start, end, period), self.draw_revenue,
+                           self.report_error("Ошибка при построении выручки за период"), key='plot_revenue')
+
+    def draw_revenue(self, rows):
+        orders, total = sum(row[1] for row in rows), sum(row[2] for row in rows)
+        self.analytics_status['text'] = f"Выручка за период: {total:.2f}, заказов: {orders}"
+        try:
+            self.render_chart(self.revenue_chart, [row[0] for row in rows], [row[2] for row in rows])
+        except Exception as e:
+            messagebox.showerror("Ошибка построения графика", f"Ошибка при построении выручки за период: {e}")
+
     def plot_geo_clients(self):
+        self.init_charts()
+
+        # Город разобран при сохранении клиента; агрегат идет по индексу idx_clients_city
+        self.worker.submit(ANALYTICS.geography, self.draw_geo_clients,
+                           self.report_error("Ошибка при построении географии клиентов"), key='plot_geo')
+
+    def draw_geo_clients(self, rows):
+        self.analytics_status['text'] = f"География: {ANALYTICS.summary('geography')}"
+        rows = rows[:self.GEO_CITIES]
         try:
-            df = pd.read_sql_query('SELECT address FROM clients', sqlite3.connect('shop.db'))
-            # Предположим, что в адресе есть город - возьмем первое слово
-            df['city'] = df['address'].apply(lambda x: x.split()[0] if x else 'Не определен')
-            city_counts = df['city'].value_counts()
-            plt.figure()
-            sns.barplot(x=city_counts.index, y=city_counts.values, color='red')
-            plt.title('География клиентов по городам')
-            plt.ylabel('Количество клиентов')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.show()
+            self.render_chart(self.geo_chart, [row[0] for row in rows], [row[1] for row in rows])
         except Exception as e:
             messagebox.showerror("Ошибка построения графика", f"Ошибка при построении географии клиентов: {e}")
 
+# --- Нагрузочный замер без интерфейса ---
+class Benchmark:
+    """Синтетическая база заданного размера и замер всех путей данных без Tk"""
+
+    CITIES = (('Москва', 30), ('Санкт-Петербург', 15), ('Новосибирск', 6), ('Екатеринбург', 6), ('Казань', 5),
+              ('Нижний Новгород', 5), ('Челябинск', 4), ('Самара', 4), ('Омск', 4), ('Ростов-на-Дону', 4),
+              ('Уфа', 4), ('Красноярск', 3), ('Воронеж', 3), ('Пермь', 3), ('Тверь', 2), ('Химки', 2))
+    SURNAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков')
+    NAMES = ('Александр', 'Сергей', 'Дмитрий', 'Андрей', 'Алексей', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Анна')
+    GOODS = (('Хлеб', 'шт'), ('Молоко', 'л'), ('Сыр', 'кг'), ('Кофе', 'уп'), ('Чай', 'уп'), ('Яблоки', 'кг'),
+             ('Масло', 'шт'), ('Сахар', 'кг'), ('Вода', 'л'), ('Печенье', 'уп'))
+    ITEMS_PER_ORDER = (1, 2, 3, 4, 5, 6, 7, 8, 10)
+    ITEMS_WEIGHTS = (35, 25, 15, 10, 6, 4, 2, 2, 1)
+    QUANTITIES = (1, 2, 3, 5, 10)
+    QUANTITY_WEIGHTS = (60, 20, 10, 7, 3)
+    HISTORY_DAYS = 730      # заказы равномерно растянуты на два года до сегодняшнего дня
+
+    def __init__(self, lines, seed=1, chunk_size=10000, single_orders=200):
+        self.lines = lines                  # сколько позиций заказов сгенерировать
+        self.clients = max(100, lines // 20)
+        self.products = max(50, min(20000, lines // 200))
+        self.chunk_size = chunk_size
+        self.single_orders = single_orders  # заказов, сохраняемых по одному через Order.save
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.timings = {}
+
+    @contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        yield
+        self.timings[name] = round(time.perf_counter() - started, 4)
+
+    def _skewed(self, count):
+        # Небольшая часть клиентов и товаров дает основную долю заказов
+        return 1 + int(count * self.rng.random() ** 3)
+
+    def _client_rows(self):
+        cities, weights = zip(*self.CITIES)
+        for index in range(self.clients):
+            address = f"г. {self.rng.choices(cities, weights)[0]}, ул. Ленина, д. {index % 200 + 1}"
+            yield ((f"{self.rng.choice(self.SURNAMES)} {self.rng.choice(self.NAMES)}", f"9{index:09d}",
+                    f"client{index}@example.com", address) + parse_address(address))
+
+    def _product_rows(self):
+        for index in range(self.products):
+            name, unit = self.GOODS[index % len(self.GOODS)]
+            yield f"{name} {index}", round(self.rng.lognormvariate(5, 1), 2), unit
+
+    def _orders(self):
+        lines = 0
+        history = datetime.timedelta(days=self.HISTORY_DAYS)
+        started = datetime.datetime.now().replace(microsecond=0) - history
+        while lines < self.lines:
+            order = Order()
+            order.client_id = self._skewed(self.clients)
+            order.created_at = (started + history * (lines / self.lines)).isoformat(' ', 'seconds')
+            for _ in range(min(self.rng.choices(self.ITEMS_PER_ORDER, self.ITEMS_WEIGHTS)[0], self.lines - lines)):
+                order.add_item(self._skewed(self.products), self.rng.choices(self.QUANTITIES, self.QUANTITY_WEIGHTS)[0])
+            lines += len(order.items)
+            yield order
+
+    def _insert(self, table, rows):
+        insert_sql = CsvImporter.TABLES[table][1]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.chunk_size:
+                with Database.transaction() as cursor:
+                    cursor.executemany(insert_sql, batch)
+                batch = []
+        if batch:
+            with Database.transaction() as cursor:
+                cursor.executemany(insert_sql, batch)
+
+    def populate(self):
+        with self.timed('insert_clients'):
+            self._insert('clients', self._client_rows())
+        with self.timed('insert_products'):
+            self._insert('products', self._product_rows())
+        orders = self._orders()
+        with self.timed('order_save'):
+            for _, order in zip(range(self.single_orders), orders):
+                order.save()
+        with self.timed('order_save_many'):
+            while True:
+                chunk = [order for _, order in zip(range(self.chunk_size), orders)]
+                if not chunk:
+                    break
+                Order.save_many(chunk, self.chunk_size)
+
+    def measure(self, pages=50):
+        pager = KeysetPager('order_totals t', ('t.client_fio', 't.items', 't.total'), key=('t.order_id',))
+        with self.timed('list_orders_count'):
+            total = pager.count()
+        with self.timed('list_orders_scroll'):
+            for start in range(0, min(total, pages * pager.page_size), pager.page_size):
+                pager.rows(start, pager.page_size)
+        with self.timed('list_orders_jump'):
+            pager.reset()
+            pager.rows(total // 2, pager.page_size)
+        for column, sort_key in App.ORDER_SORT_KEYS.items():
+            for descending in (False, True):
+                with self.timed(f"sort_orders_{column.lower()}_{'desc' if descending else 'asc'}"):
+                    pager.set_order((sort_key, 't.order_id'), descending)
+                    pager.rows(0, pager.page_size)
+                    pager.rows(total // 2, pager.page_size)
+        analytics = Analytics()
+        for name, query in (('top_clients', lambda: analytics.top_clients(5)), ('geography', analytics.geography)):
+            with self.timed(f"{name}_cold"):
+                query()
+            with self.timed(f"{name}_cached"):
+                query()
+        today = datetime.date.today()
+        with self.timed('revenue_by_day_year'):
+            Analytics.revenue((today - datetime.timedelta(days=365)).isoformat(), today.isoformat(), 'day')
+        with self.timed('revenue_by_month_all'):
+            Analytics.revenue((today - datetime.timedelta(days=self.HISTORY_DAYS)).isoformat(), today.isoformat(), 'month')
+
+    def run(self):
+        self.populate()
+        self.measure()
+        counts = {table: Database.fetch_all(f"SELECT COUNT(*) FROM {table}")[0][0]
+                  for table in ('clients', 'products', 'orders', 'order_items')}
+        return {'lines': self.lines, 'seed': self.seed, 'sqlite': sqlite3.sqlite_version,
+                'counts': counts, 'timings': self.timings}
+
+    @staticmethod
+    def compare(results, baseline, tolerance=0.25, noise=0.005):
+        """[(замер, было, стало)] для замеров, ставших медленнее больше чем на tolerance"""
+        regressions = []
+        for name, seconds in results['timings'].items():
+            before = baseline.get('timings', {}).get(name)
+            # Разницу в пределах шума таймера регрессией не считаем
+            if before is not None and seconds > before * (1 + tolerance) and seconds - before > noise:
+                regressions.append((name, before, seconds))
+        return regressions
+
+    @staticmethod
+    def parse_size(text):
+        """Размер вида 10000, 10k, 1M, 10M"""
+        match = re.fullmatch(r'(\d+)([kKmM]?)', text.strip())
+        if not match:
+            raise argparse.ArgumentTypeError(f"Неверный размер: {text}")
+        return int(match.group(1)) * {'': 1, 'k': 1000, 'm': 1000000}[match.group(2).lower()]
+
+
 #--- тесты ---
 class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        Database.configure(os.path.join(self.tmpdir, 'test.db'))
+        Database.init_db()
+
+    def tearDown(self):
+        ANALYTICS.clear()
+        QUERY_STATS.reset()
+        Database._listeners.clear()
+        CLIENTS_CACHE.clear()
+        PRODUCTS_CACHE.clear()
+        Database.configure()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
     
     def test_client_validation_success(self):        
         client = Client("Иванов Иван", "9123456789", "test@example.com", "Москва")
@@ -491,15 +2674,898 @@ class Tests(unittest.TestCase):
         with self.assertRaises(ValueError):
             order.save()
 
+    def test_database_pragmas(self):
+        with Database.reader() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+            self.assertEqual(conn.execute("PRAGMA temp_store").fetchone()[0], 2)
+
+    def test_database_reuses_connections(self):
+        with Database.writer() as first:
+            pass
+        Database.execute_query("INSERT INTO products (name, price, unit) VALUES (?, ?, ?)", ("Хлеб", 50.0, "шт"))
+        with Database.writer() as second:
+            self.assertIs(first, second)
+        with Database.reader() as first_reader:
+            pass
+        with Database.reader() as second_reader:
+            self.assertIs(first_reader, second_reader)
+
+    def test_database_close_and_reopen(self):
+        row_id = Database.execute_query("INSERT INTO products (name, price, unit) VALUES (?, ?, ?)", ("Хлеб", 50.0, "шт"))
+        Database.close()
+        self.assertIsNone(Database._writer)
+        self.assertEqual(Database.fetch_all("SELECT id, name FROM products"), [(row_id, "Хлеб")])
+
+    def test_order_save_single_transaction(self):
+        order = Order()
+        order.client_id = 1
+        for product_id in range(1, 51):
+            order.add_item(product_id, 2)
+        order_id = order.save()
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM order_items WHERE order_id=?", (order_id,)), [(50,)])
+
+    def test_order_save_rolls_back_on_error(self):
+        order = Order()
+        order.client_id = 1
+        order.add_item(1, 1)
+        order.add_item(2, object())
+        with self.assertRaises(DatabaseError):
+            order.save()
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM orders"), [(0,)])
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM order_items"), [(0,)])
+
+    def test_order_save_many(self):
+        orders = []
+        for i in range(2500):
+            order = Order()
+            order.client_id = i % 7 + 1
+            order.add_item(1, 1)
+            order.add_item(2, 3)
+            orders.append(order)
+        order_ids = Order.save_many(orders, chunk_size=1000)
+        self.assertEqual(len(order_ids), 2500)
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM orders"), [(2500,)])
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*), SUM(quantity) FROM order_items"), [(5000, 10000)])
+
+    def test_migrations_set_user_version(self):
+        self.assertEqual(Database.schema_version(), len(MIGRATIONS))
+        Database.init_db()
+        self.assertEqual(Database.schema_version(), len(MIGRATIONS))
+
+    def test_lookup_uses_index(self):
+        plan = Database.fetch_all("EXPLAIN QUERY PLAN SELECT id FROM clients WHERE fio=?", ("Иванов Иван",))
+        self.assertIn('idx_clients_fio', ' '.join(row[-1] for row in plan))
+        plan = Database.fetch_all("EXPLAIN QUERY PLAN SELECT * FROM order_items WHERE order_id=?", (1,))
+        self.assertIn('idx_order_items_order_id', ' '.join(row[-1] for row in plan))
+
+    def test_unique_phone_on_clean_data(self):
+        Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        with self.assertRaisesRegex(ValueError, "9123456789 уже есть"):
+            Client("Петров Петр", "9123456789", "b@example.com", "Тверь").save()
+
+    def test_migrate_legacy_database_with_duplicates(self):
+        Database.configure(os.path.join(self.tmpdir, 'legacy.db'))
+        with Database.writer() as conn:
+            conn.execute("CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, fio TEXT, phone TEXT, email TEXT, address TEXT)")
+            conn.executemany("INSERT INTO clients (fio, phone, email, address) VALUES (?, ?, ?, ?)",
+                             [("Иванов", "9123456789", "a@b.ru", "Москва")] * 2 + [("Без телефона", None, "", "")] * 2)
+        log = io.StringIO()
+        with redirect_stderr(log):
+            Database.init_db()
+        self.assertEqual(Database.schema_version(), len(MIGRATIONS))
+        indexes = dict(Database.fetch_all("SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name='clients'"))
+        self.assertNotIn('ux_clients_phone', indexes)
+        self.assertIn('idx_clients_phone', indexes)
+        self.assertIn('idx_clients_fio', indexes)
+        self.assertIn("ux_clients_phone не создан", log.getvalue())
+        self.assertIn("9123456789 (2 раз)", log.getvalue())
+        # Повторы убрали - уникальный индекс появляется при следующем запуске; NULL ему не мешают
+        Database.execute_query("DELETE FROM clients WHERE id=2")
+        Database.init_db()
+        indexes = dict(Database.fetch_all("SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name='clients'"))
+        self.assertIn('UNIQUE', indexes['ux_clients_phone'])
+        self.assertNotIn('idx_clients_phone', indexes)
+
+    def _fill_products(self, count):
+        with Database.transaction() as cursor:
+            cursor.executemany("INSERT INTO products (name, price, unit) VALUES (?, ?, ?)",
+                               [(f"Товар {i}", float(i), "шт") for i in range(count)])
+
+    def test_keyset_pager_sequential_pages(self):
+        self._fill_products(1000)
+        # Дыры в id не должны сдвигать страницы
+        Database.execute_query("DELETE FROM products WHERE id % 7 = 0")
+        expected = Database.fetch_all("SELECT id, name FROM products ORDER BY id")
+        pager = KeysetPager('products', ('name',), page_size=50, keep_pages=1)
+        for start in range(0, len(expected), 20):
+            rows = pager.rows(start, 20)
+            self.assertEqual([(key[0], values[0]) for key, values in rows], expected[start:start + 20])
+        self.assertEqual(pager.count(), len(expected))
+        self.assertLessEqual(len(pager.pages), 4)
+
+    def test_keyset_pager_jump_and_backward(self):
+        self._fill_products(1000)
+        pager = KeysetPager('products', ('name',), page_size=50)
+        pager.descending = True
+        rows = pager.rows(600, 10)
+        self.assertEqual([key[0] for key, _ in rows], list(range(400, 390, -1)))
+        rows = pager.rows(540, 10)
+        self.assertEqual([key[0] for key, _ in rows], list(range(460, 450, -1)))
+        self.assertEqual(pager.rows(995, 10)[-1][0], (1,))
+        self.assertEqual(pager.rows(1000, 10), [])
+
+    def test_save_notifies_with_lastrowid(self):
+        events = []
+        Database.subscribe('clients', lambda row_id: events.append(('clients', row_id)))
+        Database.subscribe('orders', lambda row_id: events.append(('orders', row_id)))
+        client_id = Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        order = Order()
+        order.client_id = client_id
+        order.add_item(1, 1)
+        order_id = order.save()
+        Order.save_many([order])
+        self.assertEqual(events, [('clients', client_id), ('orders', order_id), ('orders', None)])
+
+    def test_keyset_pager_insert_appends_to_cached_pages(self):
+        self._fill_products(120)
+        pager = KeysetPager('products', ('name',), page_size=50)
+        pager.rows(0, 150)
+        product_id = Product("Новый", 1.0, "шт").save()
+        self.assertEqual(pager.insert(product_id)[0], (product_id,))
+        self.assertEqual(pager.count(), 121)
+        self.assertEqual(sorted(pager.pages), [0, 1, 2])
+        self.assertEqual(pager.rows(120, 5)[-1][1], ("Новый",))
+
+    def test_keyset_pager_insert_drops_shifted_pages(self):
+        self._fill_products(120)
+        pager = KeysetPager('products', ('name',), page_size=50)
+        pager.descending = True
+        pager.rows(0, 150)
+        product_id = Product("Новый", 1.0, "шт").save()
+        pager.insert(product_id)
+        self.assertEqual(pager.pages, {})
+        self.assertEqual(pager.rows(0, 1)[0][0], (product_id,))
+
+    def _make_order(self, client_id, *items):
+        order = Order()
+        order.client_id = client_id
+        for product_id, quantity in items:
+            order.add_item(product_id, quantity)
+        return order
+
+    def test_order_totals_maintained_by_triggers(self):
+        client_id = Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        bread = Product("Хлеб", 50.0, "шт").save()
+        milk = Product("Молоко", 80.0, "л").save()
+        order_id = self._make_order(client_id, (bread, 2), (milk, 1)).save()
+        self._make_order(client_id, (milk, 3)).save()
+        self.assertEqual(Database.fetch_all("SELECT items, items_count, total FROM order_totals WHERE order_id=?", (order_id,)),
+                         [("Хлеб x2, Молоко x1", 2, 180.0)])
+        self.assertEqual(Database.fetch_all("SELECT orders_count, total FROM client_revenue WHERE client_id=?", (client_id,)),
+                         [(2, 420.0)])
+        # Смена цены в прайсе не меняет уже оформленные заказы
+        Database.execute_query("UPDATE products SET price=100 WHERE id=?", (bread,))
+        self.assertEqual(Database.fetch_all("SELECT total FROM order_totals WHERE order_id=?", (order_id,)), [(180.0,)])
+        Database.execute_query("DELETE FROM order_items WHERE order_id=? AND product_id=?", (order_id, bread))
+        Database.execute_query("UPDATE order_items SET quantity=2 WHERE order_id=?", (order_id,))
+        self.assertEqual(Database.fetch_all("SELECT items, items_count, total FROM order_totals WHERE order_id=?", (order_id,)),
+                         [("Молоко x2", 1, 160.0)])
+        Database.execute_query("DELETE FROM orders WHERE id=?", (order_id,))
+        Database.execute_query("DELETE FROM order_items WHERE order_id=?", (order_id,))
+        self.assertEqual(Database.fetch_all("SELECT orders_count, total FROM client_revenue WHERE client_id=?", (client_id,)),
+                         [(1, 240.0)])
+        self.assertEqual(Database.verify_aggregates(), [])
+
+    def test_verify_and_rebuild_aggregates(self):
+        client_id = Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        bread = Product("Хлеб", 50.0, "шт").save()
+        order_id = self._make_order(client_id, (bread, 2)).save()
+        Database.execute_query("UPDATE order_totals SET total=0")
+        self.assertIn(('order_totals', order_id), Database.verify_aggregates())
+        Database.rebuild_aggregates()
+        self.assertEqual(Database.verify_aggregates(), [])
+        self.assertEqual(main(['--db', Database.path, 'aggregates']), 0)
+
+    def test_order_aggregates_backfilled_on_legacy_database(self):
+        Database.configure(os.path.join(self.tmpdir, 'legacy.db'))
+        with Database.writer() as conn:
+            conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, price REAL, unit TEXT)")
+            conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER)")
+            conn.execute("CREATE TABLE order_items (order_id INTEGER, product_id INTEGER, quantity INTEGER)")
+            conn.execute("INSERT INTO products (name, price, unit) VALUES ('Хлеб', 50, 'шт')")
+            conn.execute("INSERT INTO orders (client_id) VALUES (1)")
+            conn.execute("INSERT INTO order_items VALUES (1, 1, 3)")
+        Database.init_db()
+        self.assertEqual(Database.fetch_all("SELECT client_id, total FROM client_revenue"), [(1, 150.0)])
+        self.assertEqual(Database.verify_aggregates(), [])
+
+    class ManualRoot:
+        """Вместо окна Tk: опрос очереди DbWorker тест вызывает сам"""
+        def after(self, ms, callback):
+            self.poll = callback
+
+    def test_db_worker_drops_superseded_results(self):
+        root = self.ManualRoot()
+        worker = DbWorker(root, max_workers=1)
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'old'
+        delivered, errors = [], []
+        worker.submit(slow, delivered.append, key='orders')
+        started.wait(5)
+        worker.submit(lambda: 'skipped', delivered.append, key='orders')
+        worker.submit(lambda: 'new', delivered.append, key='orders')
+        worker.submit(lambda: 1 / 0, on_error=errors.append)
+        release.set()
+        worker.executor.shutdown(wait=True)
+        root.poll()
+        self.assertEqual(delivered, ['new'])
+        self.assertIsInstance(errors[0], ZeroDivisionError)
+        self.assertEqual(worker.pending, 0)
+
+    def test_db_worker_shutdown_cancels_long_jobs(self):
+        client_id = Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        bread = Product("Хлеб", 10.0, "шт").save()
+        Order.save_many([self._make_order(client_id, (bread, i + 1)) for i in range(5)])
+        worker = DbWorker(self.ManualRoot(), max_workers=1)
+        started, release = threading.Event(), threading.Event()
+        path = os.path.join(self.tmpdir, 'orders.csv')
+
+        def progress(stats):
+            started.set()
+            release.wait(5)
+        exporter = OrderExporter(chunk_size=1, progress=progress, cancel=worker.stopping)
+        errors = []
+        export = worker.submit(lambda: exporter.run(path), on_error=errors.append)
+        queued = worker.submit(lambda: 'never')
+        started.wait(5)
+        begun = time.perf_counter()
+        worker.shutdown()
+        # Закрытие окна не ждет выгрузку, а она останавливается на следующей порции
+        self.assertLess(time.perf_counter() - begun, 1)
+        self.assertTrue(queued.cancelled())
+        release.set()
+        export.result(5)
+        worker.results.get(timeout=5)()
+        self.assertIsInstance(errors[0], JobCancelled)
+        self.assertFalse(os.path.exists(path))
+
+    def _write_csv(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_csv_import_clients_with_rejects(self):
+        Client("Старый клиент", "9000000000", "old@example.com", "Тверь").save()
+        source = self._write_csv('clients.csv', (
+            "fio;phone;email;address\n"
+            "Иванов Иван;9123456789;a@example.com;Москва\n"
+            "Петров Петр;123;b@example.com;Тверь\n"
+            "Сидоров Сидор;9000000000;c@example.com;Казань\n"
+            "Смирнов Олег;9123456780;d@example.com;Омск\n"
+            "Копия Ивана;9123456789;e@example.com;Москва\n"
+        ))
+        rejects = os.path.join(self.tmpdir, 'rejects.csv')
+        events, progress = [], []
+        Database.subscribe('clients', events.append)
+        stats = CsvImporter('clients', batch_size=2, progress=progress.append).run(source, rejects)
+        self.assertEqual((stats.processed, stats.imported, stats.rejected), (5, 2, 3))
+        self.assertEqual(events, [None])
+        self.assertEqual(progress[-1], stats)
+        with open(rejects, encoding='utf-8') as f:
+            lines = [row[:3] for row in csv.reader(f)][1:]
+        self.assertEqual([line for line, _, _ in lines], ['3', '4', '6'])
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM clients"), [(3,)])
+
+    def test_csv_import_products_cli(self):
+        source = self._write_csv('products.csv', "name,price,unit\nХлеб,\"45,5\",шт\nМолоко,дорого,л\n")
+        self.assertEqual(main(['--db', Database.path, 'import', 'products', source]), 0)
+        self.assertEqual(Database.fetch_all("SELECT name, price FROM products"), [("Хлеб", 45.5)])
+        with open(os.path.join(self.tmpdir, 'products.rejects.csv'), encoding='utf-8') as f:
+            self.assertEqual([row[:3] for row in csv.reader(f)][1:], [['3', 'Стоимость должна быть числом >= 0', 'Молоко']])
+        clean = self._write_csv('clean.csv', "name,price,unit\nСоль,10,кг\n")
+        self.assertEqual(main(['--db', Database.path, 'import', 'products', clean]), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'clean.rejects.csv')))
+        bad = self._write_csv('bad.csv', "title,cost\nХлеб,1\n")
+        self.assertEqual(main(['--db', Database.path, 'import', 'products', bad]), 1)
+
+    def test_orders_sorted_in_database(self):
+        clients = [Client(fio, f"91234567{i:02d}", f"{i}@example.com", "Москва").save()
+                   for i, fio in enumerate(["Борисов", "Алексеев", "Васильев"])]
+        products = [Product(f"Товар {i}", float(i * 10 + 5), "шт").save() for i in range(5)]
+        orders = [self._make_order(clients[i % 3], *[(products[j], i + 1) for j in range(i % 4 + 1)]) for i in range(40)]
+        Order.save_many(orders)
+        expected = Database.fetch_all("SELECT total, order_id FROM order_totals")
+        pager = KeysetPager('order_totals t', ('t.client_fio', 't.items', 't.total'), page_size=7)
+        for column, descending in (('t.total', True), ('t.items_count', False), ('t.client_fio', False)):
+            pager.set_order((column, 't.order_id'), descending)
+            keys = [key for start in range(0, 40, 5) for key, _ in pager.rows(start, 5)]
+            self.assertEqual(keys, sorted(keys, reverse=descending))
+            self.assertEqual(len(set(keys)), 40)
+            plan = Database.fetch_all(f"EXPLAIN QUERY PLAN SELECT t.order_id FROM order_totals t ORDER BY {column}, t.order_id")
+            self.assertNotIn('TEMP B-TREE', ' '.join(row[-1] for row in plan))
+        self.assertEqual(sorted(expected), sorted((values[2], key[-1]) for key, values in pager.rows(0, 40)))
+        Database.execute_query("UPDATE clients SET fio='Яковлев' WHERE id=?", (clients[0],))
+        self.assertEqual(Database.fetch_all("SELECT DISTINCT client_fio FROM order_totals WHERE client_id=?", (clients[0],)),
+                         [("Яковлев",)])
+        self.assertEqual(Database.verify_aggregates(), [])
+
+    def test_full_text_search(self):
+        ivanov = Client("Иванов Иван", "9123456789", "ivan@example.com", "Москва, ул. Ленина").save()
+        Client("Петров Петр", "9987654321", "petr@example.com", "Тверь").save()
+        ivanova = Client("Иванова Мария", "9555555555", "maria@example.com", "Казань").save()
+        self.assertEqual({row[0] for row in Search.clients("иван")}, {ivanov, ivanova})
+        self.assertEqual([row[0] for row in Search.clients("ИВАН москв")], [ivanov])
+        self.assertEqual([row[0] for row in Search.clients("912")], [ivanov])
+        self.assertEqual(Search.clients("  ,;  "), [])
+        Database.execute_query("UPDATE clients SET address='Самара' WHERE id=?", (ivanov,))
+        self.assertEqual(Search.clients("москв"), [])
+        Database.execute_query("DELETE FROM clients WHERE id=?", (ivanova,))
+        self.assertEqual([row[0] for row in Search.clients("иван")], [ivanov])
+        Product("Хлеб белый", 40.0, "шт").save()
+        Product("Молоко", 80.0, "л").save()
+        self.assertEqual([row[1] for row in Search.products("хле")], ["Хлеб белый"])
+        pager = KeysetPager('clients', ('fio',))
+        pager.set_filter(*Search.filter('clients', "петр"))
+        self.assertEqual([values for _, values in pager.rows(0, 10)], [("Петров Петр",)])
+        pager.set_filter(*Search.filter('clients', ""))
+        self.assertEqual(pager.count(), 2)
+
+    def test_catalog_cache_lru(self):
+        self._fill_products(5)
+        twin = Product("Товар 1", 99.0, "кг").save()
+        cache = CatalogCache('products', ('name', 'price', 'unit'), capacity=4)
+        rows = cache.fill(limit=10)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(list(cache.rows), [3, 4, 5, twin])
+        self.assertEqual(cache.get(twin), ("Товар 1", 99.0, "кг"))
+        self.assertEqual(cache.get(2), ("Товар 1", 1.0, "шт"))
+        self.assertNotIn(3, cache.rows)
+        Database.execute_query("UPDATE products SET price=5 WHERE id=?", (twin,))
+        cache.clear()
+        self.assertEqual(cache.get(twin)[1], 5.0)
+        self.assertIsNone(cache.get(999))
+
+    def test_order_form_loads_from_warm_catalog_cache(self):
+        class Worker:
+            def submit(self, func, on_done=None, on_error=None, key=None):
+                on_done(func())
+
+        app = App.__new__(App)
+        app.worker = Worker()
+        app.combo_clients = {}
+        Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        app.load_clients_for_order()
+        with QUERY_STATS.action('combo_clients') as counter:
+            app.load_clients_for_order()
+            petrov = Client("Петров Петр", "9123456780", "p@example.com", "Омск").save()
+            app.load_clients_for_order()
+        # Повторные загрузки берут справочник из кэша; запрос один - вставка нового клиента
+        self.assertEqual(counter[0], 1)
+        self.assertEqual(app.client_choices[-1], petrov)
+        self.assertEqual(app.combo_clients['values'][-1], "Петров Петр (9123456780)")
+        source = self._write_csv('clients.csv', "fio,phone,email,address\nСидоров,9123456781,s@example.com,Тула\n")
+        CsvImporter('clients').run(source)
+        app.load_clients_for_order()
+        self.assertEqual(len(app.client_choices), 3)
+
+    def test_saved_rows_reach_order_form_despite_tab_filter(self):
+        class Worker:
+            def submit(self, func, on_done=None, on_error=None, key=None):
+                on_done(func())
+
+        class Listbox(list):
+            def insert(self, index, label):
+                self.append(label)
+
+        Client("Петров Петр", "9000000001", "p@example.com", "Москва").save()
+        where, params = Search.filter('clients', "петр")
+        clients_pager = KeysetPager('clients', ('fio', 'phone', 'email', 'address'), where=where, params=params)
+        where, params = Search.filter('products', "молоко")
+        products_pager = KeysetPager('products', ('name', 'price', 'unit'), where=where, params=params)
+        inserted = []
+        app = App.__new__(App)
+        app.worker = Worker()
+        app.tree_clients = types.SimpleNamespace(insert_row=lambda row_id: inserted.append(clients_pager.insert(row_id)))
+        app.tree_products = types.SimpleNamespace(insert_row=lambda row_id: inserted.append(products_pager.insert(row_id)))
+        app.client_choices, app.product_choices = [], []
+        app.combo_clients = {'values': ()}
+        app.list_products = Listbox()
+
+        client_id = Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        app.on_client_saved(client_id)
+        product_id = Product("Хлеб", 50.0, "шт").save()
+        app.on_product_saved(product_id)
+        # Отфильтрованные таблицы новые строки не показывают, форма заказа - показывает
+        self.assertEqual(inserted, [None, None])
+        self.assertEqual((app.client_choices, app.combo_clients['values']), ([client_id], ("Иванов Иван (9123456789)",)))
+        self.assertEqual((app.product_choices, app.list_products), ([product_id], ["Хлеб - 50.00 руб./шт"]))
+
+    def test_product_search_keeps_selected_labels(self):
+        class Listbox(list):
+            selected = ()
+
+            def curselection(self):
+                return tuple(self.selected)
+
+            def get(self, index):
+                return self[index]
+
+            def delete(self, first, last):
+                self.clear()
+
+            def insert(self, index, label):
+                self.append(label)
+
+            def selection_set(self, first, last):
+                self.selected = range(first, last + 1)
+
+        app = App.__new__(App)
+        app.product_choices = [7, 42]
+        app.list_products = Listbox(["Хлеб - 50.00 руб./шт", "Соль - 9.90 руб./кг"])
+        app.list_products.selected = (1,)
+        # Новая выдача поиска не содержит отмеченный товар, а в кэше справочника его нет
+        app.show_products_for_order([(7, "Хлеб", 50.0, "шт"), (8, "Молоко", 80.0, "л")])
+        self.assertEqual(app.product_choices, [42, 7, 8])
+        self.assertEqual(app.list_products, ["Соль - 9.90 руб./кг", "Хлеб - 50.00 руб./шт", "Молоко - 80.00 руб./л"])
+        self.assertEqual(app.list_products.curselection(), (0,))
+
+    @unittest.skipUnless(importlib.util.find_spec('matplotlib'), "matplotlib не установлен")
+    def test_bar_chart_updates_artists_in_place(self):
+        load_analytics()
+        ax = Figure().add_subplot()
+        chart = BarChart(ax, "Топ", "Сумма")
+        self.assertTrue(chart.update(["Алиса", "Борис"], [30.0, 10.0]))
+        bars = chart.bars
+        self.assertFalse(chart.update(["Алиса", "Борис"], [30.0, 10.0]))
+        self.assertTrue(chart.update(["Борис", "Алиса"], [40.0, 30.0]))
+        self.assertIs(chart.bars, bars)
+        self.assertEqual([bar.get_height() for bar in bars], [40.0, 30.0])
+        self.assertEqual([label.get_text() for label in ax.get_xticklabels()], ["Борис", "Алиса"])
+        self.assertEqual(ax.get_ylim()[1], 44.0)
+        chart.update(["Алиса"], [5.0])
+        self.assertEqual(len(ax.patches), 1)
+
+    def test_analytics_not_imported_at_startup(self):
+        code = ("import importlib.util, sys; spec = importlib.util.spec_from_file_location('crm', sys.argv[1]); "
+                "module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module); "
+                "print(sorted({'pandas', 'matplotlib', 'seaborn'} & set(sys.modules)))")
+        output = subprocess.run([sys.executable, '-c', code, os.path.abspath(__file__)],
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_startup_timer_report(self):
+        timer = StartupTimer(time.perf_counter())
+        timer.mark("импорт модулей")
+        timer.mark("построение интерфейса")
+        out = io.StringIO()
+        timer.report(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines], ["импорт", "построение", "итого"])
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("Москва"), ("Москва", "Москва"))
+        self.assertEqual(parse_address("г. Тверь, ул. Ленина, д. 5"), ("Тверь", None))
+        self.assertEqual(parse_address("Россия, 141400, Московская обл., г Химки, ул. Мира 1"),
+                         ("Химки", "Московская обл"))
+        self.assertEqual(parse_address("казань ул Баумана 12"), ("Казань", None))
+        self.assertEqual(parse_address("ул. Ленина, 5"), (None, None))
+        self.assertEqual(parse_address(""), (None, None))
+
+    def test_client_city_saved_and_backfilled(self):
+        Client("Иванов Иван", "9123456789", "a@example.com", "г. Тверь, ул. Ленина").save()
+        source = self._write_csv('clients.csv', "fio,phone,email,address\nПетров Петр,9123456780,b@example.com,\"Тверь, пр. Мира\"\n")
+        CsvImporter('clients').run(source)
+        self.assertEqual(Analytics().geography(), [("Тверь", 2)])
+        plan = Database.fetch_all("EXPLAIN QUERY PLAN SELECT city, COUNT(*) FROM clients GROUP BY city")
+        self.assertIn('idx_clients_city', ' '.join(row[-1] for row in plan))
+
+        Database.configure(os.path.join(self.tmpdir, 'legacy.db'))
+        with Database.writer() as conn:
+            conn.execute("CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, fio TEXT, phone TEXT, email TEXT, address TEXT)")
+            conn.executemany("INSERT INTO clients (fio, phone, email, address) VALUES (?, ?, ?, ?)",
+                             [("А", "9000000001", "a@b.ru", "Омск, ул. Ленина"), ("Б", "9000000002", "b@b.ru", ""),
+                              ("В", "9000000003", "c@b.ru", "г. Омск")])
+        Database.init_db()
+        self.assertEqual(Analytics().geography(), [("Омск", 2), ("Не определен", 1)])
+        self.assertEqual({row[0] for row in Search.clients("омск")}, {1, 3})
+
+    def test_analytics_cache_hit_fold_and_miss(self):
+        clients = [Client(f"Клиент {i}", f"91234567{i:02d}", f"{i}@example.com", f"Город{i % 3}").save() for i in range(8)]
+        bread = Product("Хлеб", 10.0, "шт").save()
+        Order.save_many([self._make_order(client_id, (bread, i + 1)) for i, client_id in enumerate(clients)])
+        analytics = Analytics()
+        top = analytics.top_clients(3)
+        self.assertEqual(top, [("Клиент 7", 80.0), ("Клиент 6", 70.0), ("Клиент 5", 60.0)])
+        self.assertEqual(analytics.top_clients(3), top)
+        self.assertEqual(analytics.stats[('top_clients', 3)]['last'], 'hit')
+        # Новый заказ поднимает клиента снизу - досчитывается только прирост
+        self._make_order(clients[0], (bread, 100)).save()
+        self.assertEqual(analytics.top_clients(3)[0], ("Клиент 0", 1010.0))
+        self.assertEqual(analytics.stats[('top_clients', 3)]['last'], 'fold')
+        Database.execute_query("DELETE FROM order_items WHERE quantity = 100")
+        self.assertEqual(analytics.top_clients(3)[0], ("Клиент 7", 80.0))
+        self.assertEqual(analytics.stats[('top_clients', 3)]['last'], 'miss')
+
+        self.assertEqual(analytics.geography(), [("Город0", 3), ("Город1", 3), ("Город2", 2)])
+        Client("Новый", "9000000001", "new@example.com", "Город2").save()
+        self.assertEqual(dict(analytics.geography())["Город2"], 3)
+        self.assertEqual(analytics.stats['geography']['last'], 'fold')
+        Database.execute_query("UPDATE clients SET city='Город1' WHERE fio='Новый'")
+        self.assertEqual(dict(analytics.geography())["Город1"], 4)
+        self.assertEqual(analytics.stats['geography']['miss'], 2)
+        self.assertIn("полный пересчет", analytics.summary('geography'))
+
+    def test_query_stats_histograms_and_slow_log(self):
+        self.assertEqual(QueryStats.normalize("SELECT * FROM t  WHERE id IN (?, ?, ?) AND name = 'x' LIMIT 5"),
+                         "SELECT * FROM t WHERE id IN (?, ...) AND name = ? LIMIT ?")
+        stats = QueryStats(slow_ms=0, slow_log=os.path.join(self.tmpdir, 'slow.log'))
+        with Database.reader() as conn:
+            for client_id in (1, 2, 3):
+                stats.record(conn, f"SELECT fio FROM clients WHERE id = {client_id}", (), 0.002, 1)
+        query, calls, rows, total, avg, peak, p95 = stats.top()[0]
+        self.assertEqual((query, calls, rows, total, p95), ("SELECT fio FROM clients WHERE id = ?", 3, 3, 6.0, "<5"))
+        self.assertIn("clients", ' '.join(stats.slow[0][3]))
+        with open(stats.slow_log, encoding='utf-8') as f:
+            self.assertIn("SELECT fio FROM clients WHERE id = ?", f.read())
+        # Запросы транзакций и фоновых действий тоже учитываются
+        with QUERY_STATS.action('order') as counter:
+            self._make_order(Client("Тест", "9123456789", "t@example.com", "Тверь").save(),
+                             (Product("Хлеб", 10, "шт").save(), 1)).save()
+        self.assertGreaterEqual(counter[0], 3)
+        self.assertIn(QueryStats.normalize(ORDER_INSERT), [row[0] for row in QUERY_STATS.top(100)])
+        with self.assertRaises(DatabaseError) as raised:
+            Database.fetch_all("SELECT * FROM missing_table")
+        self.assertEqual(raised.exception.query, "SELECT * FROM missing_table")
+
+    def _export_fixture(self):
+        alice = Client("Алиса", "9123456789", "a@example.com", "Москва").save()
+        bob = Client("Борис", "9234567890", "b@example.com", "Тверь").save()
+        bread, milk = Product("Хлеб", 10.0, "шт").save(), Product("Молоко", 2.5, "л").save()
+        return [self._make_order(alice, (bread, 2), (milk, 4)).save(), self._make_order(bob, (milk, 1)).save(),
+                self._make_order(alice, (bread, 1)).save()], alice
+
+    def test_export_orders_to_csv_in_chunks(self):
+        (first, second, third), alice = self._export_fixture()
+        exporter = OrderExporter(chunk_size=2)
+        self.assertEqual([len(chunk) for chunk in exporter.chunks()], [2, 2])
+        path = os.path.join(self.tmpdir, 'orders.csv')
+        self.assertEqual(exporter.run(path).rows, 4)
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([(int(row['order_id']), row['product_name']) for row in rows],
+                         [(first, "Хлеб"), (first, "Молоко"), (second, "Молоко"), (third, "Хлеб")])
+        self.assertEqual((float(rows[1]['line_total']), float(rows[1]['order_total'])), (10.0, 30.0))
+        # Фильтры по клиенту и диапазону id
+        self.assertEqual(OrderExporter(client_id=alice, min_id=second).run(path).rows, 1)
+        with self.assertRaises(ValueError):
+            exporter.run(path, 'xlsx')
+        with Database.reader() as conn:
+            query, params = OrderExporter(client_id=alice).query()
+            plan = ' '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "pyarrow не установлен")
+    def test_export_orders_to_parquet(self):
+        import pyarrow.parquet
+        self._export_fixture()
+        path = os.path.join(self.tmpdir, 'orders.parquet')
+        self.assertEqual(OrderExporter(chunk_size=3).run(path).rows, 4)
+        parquet = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        self.assertEqual(parquet.read().column('quantity').to_pylist(), [2, 4, 1, 1])
+
+    def test_revenue_rollups_follow_orders(self):
+        alice = Client("Алиса", "9123456789", "a@example.com", "Москва").save()
+        bread, milk = Product("Хлеб", 10.0, "шт").save(), Product("Молоко", 2.5, "л").save()
+        orders = []
+        for created_at, items in (("2024-01-31 23:59:00", [(bread, 2)]), ("2024-02-01 09:00:00", [(milk, 4)]),
+                                  ("2024-02-01 18:30:00", [(bread, 1), (milk, 2)])):
+            order = self._make_order(alice, *items)
+            order.created_at = created_at
+            orders.append(order)
+        first, second, third = Order.save_many(orders)
+        self.assertEqual(Analytics.revenue("2024-01-01", "2024-02-29"),
+                         [("2024-01-31", 1, 20.0), ("2024-02-01", 2, 25.0)])
+        self.assertEqual(Analytics.revenue("2024-01-15", "2024-02-15", 'month'),
+                         [("2024-01", 1, 20.0), ("2024-02", 2, 25.0)])
+        # Правка позиции, удаление позиции и заказа, перенос даты
+        Database.execute_query("UPDATE order_items SET quantity = 3 WHERE order_id = ?", (first,))
+        Database.execute_query("DELETE FROM order_items WHERE order_id = ? AND product_id = ?", (third, milk))
+        Database.execute_query("DELETE FROM order_items WHERE order_id = ?", (second,))
+        Database.execute_query("DELETE FROM orders WHERE id = ?", (second,))
+        Database.execute_query("UPDATE orders SET created_at = '2024-03-05 10:00:00' WHERE id = ?", (third,))
+        self.assertEqual(Analytics.revenue("2024-01-01", "2024-03-31", 'month'),
+                         [("2024-01", 1, 30.0), ("2024-03", 1, 10.0)])
+        self.assertEqual(Database.verify_aggregates(), [])
+        # Новый заказ без явной даты датируется текущим днем
+        self._make_order(alice, (bread, 1)).save()
+        today = datetime.date.today().isoformat()
+        self.assertEqual(Analytics.revenue(today, today), [(today, 1, 10.0)])
+        with self.assertRaises(ValueError):
+            Analytics.revenue("01.02.2024", today)
+
+    def test_archive_moves_old_orders_and_keeps_history(self):
+        alice = Client("Алиса", "9123456789", "a@example.com", "Москва").save()
+        bread = Product("Хлеб", 10.0, "шт").save()
+        orders = []
+        for day, quantity in (("2023-05-01", 1), ("2023-06-01", 2), ("2024-06-01", 3)):
+            order = self._make_order(alice, (bread, quantity))
+            order.created_at = f"{day} 12:00:00"
+            orders.append(order)
+        first, second, third = Order.save_many(orders)
+        revenue_before = Analytics.revenue("2023-01-01", "2024-12-31", 'month')
+        stats = OrderArchiver("2024-01-01", batch_size=1).run()
+        self.assertEqual(stats.orders, 2)
+        # Рабочий набор содержит только свежий заказ, итоги за всю историю не изменились
+        self.assertEqual(Database.fetch_all("SELECT order_id FROM order_totals"), [(third,)])
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM order_items"), [(1,)])
+        self.assertEqual(Database.fetch_all("SELECT orders_count, total FROM client_revenue"), [(3, 60.0)])
+        self.assertEqual(Analytics.revenue("2023-01-01", "2024-12-31", 'month'), revenue_before)
+        self.assertEqual(Database.fetch_all("SELECT active FROM archive_state"), [(0,)])
+        self.assertEqual(Database.verify_aggregates(), [])
+        Database.rebuild_aggregates()
+        self.assertEqual(Database.fetch_all("SELECT orders_count, total FROM client_revenue"), [(3, 60.0)])
+        self.assertEqual(Database.fetch_history("SELECT id FROM history_orders ORDER BY id"),
+                         [(first,), (second,), (third,)])
+        # Повторный запуск ничего не переносит; обычное удаление по-прежнему уменьшает итоги
+        self.assertEqual(OrderArchiver("2024-01-01").run().orders, 0)
+        path = os.path.join(self.tmpdir, 'history.csv')
+        self.assertEqual(OrderExporter(include_archive=True).run(path).rows, 3)
+        self.assertEqual(OrderExporter().run(path).rows, 1)
+        Database.execute_query("DELETE FROM order_items WHERE order_id = ?", (third,))
+        self.assertEqual(Database.fetch_all("SELECT orders_count, total FROM client_revenue"), [(3, 30.0)])
+        self.assertEqual(Database.verify_aggregates(), [])
+
+    def test_benchmark_small_dataset(self):
+        benchmark = Benchmark(600, seed=3, chunk_size=100, single_orders=5)
+        results = benchmark.run()
+        self.assertEqual(results['counts']['order_items'], 600)
+        self.assertEqual(results['counts']['clients'], 100)
+        self.assertEqual(Database.verify_aggregates(), [])
+        self.assertIn('sort_orders_total_desc', results['timings'])
+        self.assertIn('geography_cached', results['timings'])
+        baseline = {'timings': dict(results['timings'], order_save_many=0.0001, geography_cold=None)}
+        self.assertEqual([name for name, _, _ in Benchmark.compare(results, baseline, noise=0)], ['order_save_many'])
+        self.assertEqual(Benchmark.parse_size("10M"), 10000000)
+
+    def test_order_save_many_validates_first(self):
+        good = Order()
+        good.client_id = 1
+        good.add_item(1, 1)
+        with self.assertRaises(ValueError):
+            Order.save_many([good, Order()])
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM orders"), [(0,)])
+
+    def test_order_save_many_is_all_or_nothing(self):
+        client_id = Client("Иванов Иван", "9123456789", "a@example.com", "Москва").save()
+        bread = Product("Хлеб", 10.0, "шт").save()
+        orders = [self._make_order(client_id, (bread, 1)) for _ in range(4)]
+        # Ошибка во второй порции откатывает и уже вставленную первую
+        orders[3].created_at = object()
+        with self.assertRaises(DatabaseError):
+            Order.save_many(orders, chunk_size=2)
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM orders"), [(0,)])
+        self.assertEqual(Database.fetch_all("SELECT COUNT(*) FROM order_items"), [(0,)])
+
 # --- запуск ---
-if __name__ == "__main__":
+def run_gui(profile=False):
+    timer = StartupTimer(_MODULE_STARTED)
+    timer.mark("импорт модулей")
     try:
-        test_loader = unittest.TestLoader()
-        test_suite = test_loader.loadTestsFromTestCase(Tests)
-        unittest.TextTestRunner().run(test_suite)
         Database.init_db()
+        timer.mark("база данных и миграции")
         root = tk.Tk()
+        timer.mark("создание окна Tk")
         app = App(root)
+        timer.mark("построение интерфейса")
+        if profile:
+            def first_idle():
+                timer.mark("первый цикл событий")
+                timer.report()
+            root.after_idle(first_idle)
         root.mainloop()
     except Exception as e:
-        messagebox.showerror("Критическая ошибка", f"Программа завершена с ошибкой: {e}")
\ No newline at end of file
+        messagebox.showerror("Критическая ошибка", f"Программа завершена с ошибкой: {e}")
+    finally:
+        Database.close()
+    return 0
+
+def run_tests(args):
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(Tests)
+    result = unittest.TextTestRunner(verbosity=args.verbosity).run(test_suite)
+    return 0 if result.wasSuccessful() else 1
+
+def run_aggregates(args):
+    Database.create_schema()
+    if args.rebuild:
+        Database.rebuild_aggregates()
+        print("Сводные таблицы перестроены")
+    mismatches = Database.verify_aggregates()
+    for table, row_id in mismatches[:20]:
+        print(f"Расхождение: {table} id={row_id}")
+    print(f"Расхождений: {len(mismatches)}")
+    return 1 if mismatches else 0
+
+def run_analytics(args):
+    Database.create_schema()
+    for _ in range(max(args.repeat, 1)):
+        top = ANALYTICS.top_clients(args.top)
+        geography = ANALYTICS.geography()
+    for fio, total in top:
+        print(f"{fio}: {total:.2f}")
+    for city, count in geography[:args.top]:
+        print(f"{city}: {count}")
+    print(f"Топ клиентов: {ANALYTICS.summary(('top_clients', args.top))}")
+    print(f"География: {ANALYTICS.summary('geography')}")
+    return 0
+
+def run_benchmark(args):
+    # Синтетическая база создается отдельно, рабочий файл не затрагивается
+    workdir = args.keep or tempfile.mkdtemp(prefix='crm-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    Database.configure(os.path.join(workdir, f'bench-{args.lines}.db'))
+    try:
+        Database.create_schema()
+        if Database.fetch_all("SELECT COUNT(*) FROM orders")[0][0]:
+            print(f"База в {workdir} уже заполнена", file=sys.stderr)
+            return 1
+        results = Benchmark(args.lines, args.seed).run()
+    finally:
+        Database.close()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('lines') != results['lines']:
+        print(f"Базовый замер сделан на {baseline.get('lines')} позициях, сравнение приблизительное", file=sys.stderr)
+    regressions = Benchmark.compare(results, baseline, args.tolerance)
+    for name, before, after in regressions:
+        print(f"Регрессия: {name} {before:.4f} с -> {after:.4f} с", file=sys.stderr)
+    print(f"Регрессий: {len(regressions)}", file=sys.stderr)
+    return 1 if regressions else 0
+
+def run_export(args):
+    Database.create_schema()
+
+    def progress(stats):
+        print(f"\rВыгружено: {stats.rows} строк", end='', file=sys.stderr)
+
+    exporter = OrderExporter(args.client, args.from_id, args.to_id, args.chunk_size, progress, args.with_archive)
+    try:
+        stats = exporter.run(args.target, args.format)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка выгрузки: {e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+    print(f"Выгружено {stats.rows} строк за {stats.seconds:.1f} с")
+    return 0
+
+def run_archive(args):
+    Database.create_schema()
+
+    def progress(stats):
+        print(f"\rПеренесено заказов: {stats.orders}", end='', file=sys.stderr)
+
+    try:
+        archiver = OrderArchiver(args.before, args.batch_size, progress, vacuum=not args.no_vacuum)
+    except ValueError as e:
+        print(f"Ошибка архивации: {e}", file=sys.stderr)
+        return 1
+    stats = archiver.run()
+    print(file=sys.stderr)
+    print(f"В архив {Database.archive_path()} перенесено {stats.orders} заказов за {stats.seconds:.1f} с")
+    return 0
+
+def run_report(args):
+    Database.create_schema()
+    try:
+        rows = Analytics.revenue(args.start, args.end, args.period)
+    except ValueError as e:
+        print(f"Ошибка отчета: {e}", file=sys.stderr)
+        return 1
+    for period, orders, total in rows:
+        print(f"{period}\t{orders}\t{total:.2f}")
+    print(f"Итого: заказов {sum(row[1] for row in rows)}, выручка {sum(row[2] for row in rows):.2f}")
+    return 0
+
+def run_import(args):
+    Database.create_schema()
+
+    def progress(stats):
+        rate = stats.processed / stats.seconds if stats.seconds else 0
+        print(f"\rОбработано: {stats.processed}, загружено: {stats.imported}, "
+              f"отклонено: {stats.rejected}, {rate:.0f} строк/с", end='', file=sys.stderr)
+
+    try:
+        stats = CsvImporter(args.table, args.batch_size, progress).run(args.source, args.rejects)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка импорта: {e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+    print(f"Загружено {stats.imported} из {stats.processed} строк за {stats.seconds:.1f} с")
+    if stats.rejected:
+        print(f"Отклоненные строки: {args.rejects or CsvImporter.reject_path_for(args.source)}")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Интернет-магазин")
+    parser.add_argument('--db', default=DB_PATH, help="путь к файлу базы данных")
+    parser.add_argument('--profile-startup', action='store_true', help="вывести время фаз запуска окна")
+    parser.add_argument('--slow-ms', type=float, default=QUERY_STATS.slow_ms, help="порог медленного запроса, мс")
+    parser.add_argument('--slow-log', help="файл журнала медленных запросов")
+    parser.add_argument('--query-stats', action='store_true', help="после команды вывести самые затратные запросы")
+    commands = parser.add_subparsers(dest='command')
+    tests = commands.add_parser('test', help="запустить самопроверку")
+    tests.add_argument('-v', '--verbosity', type=int, default=1)
+    aggregates = commands.add_parser('aggregates', help="проверить сводные таблицы заказов")
+    aggregates.add_argument('--rebuild', action='store_true', help="перестроить их из исходных данных")
+    analytics = commands.add_parser('analytics', help="вывести статистику и время ее расчета")
+    analytics.add_argument('--top', type=int, default=5)
+    analytics.add_argument('--repeat', type=int, default=1, help="повторить расчет, чтобы проверить кэш")
+    bench = commands.add_parser('bench', help="замерить скорость на синтетической базе")
+    bench.add_argument('--lines', type=Benchmark.parse_size, default=10000, help="позиций заказов: 10k, 1M, 10M")
+    bench.add_argument('--seed', type=int, default=1)
+    bench.add_argument('--output', help="куда записать результаты в JSON (по умолчанию - в stdout)")
+    bench.add_argument('--baseline', help="JSON прошлого замера для поиска регрессий")
+    bench.add_argument('--tolerance', type=float, default=0.25, help="допустимое замедление, доля")
+    bench.add_argument('--keep', help="каталог, в котором оставить сгенерированную базу")
+    exporter = commands.add_parser('export', help="выгрузить позиции заказов в CSV или Parquet")
+    exporter.add_argument('target', help="файл выгрузки; формат по расширению .csv или .parquet")
+    exporter.add_argument('--format', choices=OrderExporter.FORMATS)
+    exporter.add_argument('--client', type=int, help="только заказы клиента с этим id")
+    exporter.add_argument('--from-id', type=int, help="начиная с заказа с этим id")
+    exporter.add_argument('--to-id', type=int, help="заканчивая заказом с этим id")
+    exporter.add_argument('--chunk-size', type=int, default=5000)
+    exporter.add_argument('--with-archive', action='store_true', help="включить архивные заказы")
+    archiver = commands.add_parser('archive', help="перенести старые заказы в архивный файл")
+    archiver.add_argument('--before', required=True, help="дата ГГГГ-ММ-ДД: архивируются заказы раньше нее")
+    archiver.add_argument('--batch-size', type=int, default=1000)
+    archiver.add_argument('--no-vacuum', action='store_true', help="не сжимать рабочий файл после переноса")
+    report = commands.add_parser('report', help="выручка и число заказов за период")
+    report.add_argument('--from', dest='start', default=(datetime.date.today() - datetime.timedelta(days=30)).isoformat())
+    report.add_argument('--to', dest='end', default=datetime.date.today().isoformat())
+    report.add_argument('--period', choices=sorted(Analytics.PERIODS), default='day')
+    importer = commands.add_parser('import', help="импортировать клиентов или товары из CSV")
+    importer.add_argument('table', choices=sorted(CsvImporter.TABLES))
+    importer.add_argument('source', help="CSV-файл с заголовком из имен столбцов")
+    importer.add_argument('--rejects', help="куда записать отклоненные строки (по умолчанию <файл>.rejects.csv)")
+    importer.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'test':
+        return run_tests(args)
+    QUERY_STATS.slow_ms, QUERY_STATS.slow_log = args.slow_ms, args.slow_log
+    Database.configure(args.db)
+    if args.command is None:
+        return run_gui(args.profile_startup)
+    try:
+        return {'aggregates': run_aggregates, 'analytics': run_analytics,
+                'bench': run_benchmark, 'export': run_export,
+                'report': run_report, 'archive': run_archive, 'import': run_import}[args.command](args)
+    except sqlite3.Error as e:
+        print(f"Ошибка базы данных: {e}", file=sys.stderr)
+        return 1
+    except DatabaseError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        Database.close()
+        if args.query_stats:
+            print(QUERY_STATS.report(), file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file